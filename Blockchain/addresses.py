@@ -0,0 +1,75 @@
+"""
+
+Blockchain Addresses:
+
+    Short fixed-size identities shared by the blockchain scripts
+
+    An address is the first ADDRESS_SIZE bytes of the SHA-256 of a public
+    key, written in hex. Transactions carry addresses only; the full keys
+    live in a KeyRegistry and are looked up when a signature is verified.
+
+"""
+# import libraries
+import hashlib
+import threading
+
+ADDRESS_SIZE = 20
+
+
+# address of the raw public key bytes, as a hex string
+def address_of(key):
+    return hashlib.sha256(key).digest()[:ADDRESS_SIZE].hex()
+
+def is_address(value):
+    try:
+        return len(bytes.fromhex(value)) == ADDRESS_SIZE
+    except (TypeError, ValueError):
+        return False
+
+
+class KeyRegistry:
+    # fetch(address) -> key bytes or None is called for unknown addresses,
+    # e.g. to ask a peer; fetched keys are checked against the address
+    def __init__(self, fetch=None):
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._fetch = fetch
+
+    # store a public key and return its address
+    def register(self, key):
+        key = bytes(key)
+        address = address_of(key)
+        with self._lock:
+            self._keys[address] = key
+        return address
+
+    # the public key of an address; raises KeyError if it is unknown
+    def lookup(self, address):
+        with self._lock:
+            key = self._keys.get(address)
+        if key is not None:
+            return key
+        key = self._fetch(address) if self._fetch is not None else None
+        if key is None:
+            raise KeyError(address)
+        if address_of(key) != address:
+            raise ValueError("fetched key does not match address " + address)
+        with self._lock:
+            self._keys[address] = bytes(key)
+        return bytes(key)
+
+    # the public key of an address, or None if it is unknown or its fetched
+    # key does not match it
+    def get(self, address):
+        try:
+            return self.lookup(address)
+        except (KeyError, ValueError):
+            return None
+
+    def __contains__(self, address):
+        with self._lock:
+            return address in self._keys
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
@@ -0,0 +1,191 @@
+"""
+
+Blockchain Balances:
+
+    Account-balance index shared by the blockchain scripts
+
+    Balances are kept in a dict from address to value and updated as each
+    block is applied, so checking a spend is a constant-time lookup rather
+    than a replay of the chain. The scripts only ever append blocks, so
+    applied blocks are not undone.
+
+    The balances are saved with the height they cover and the hash of the
+    block at the tip of that height to a snapshot file in the chain store's
+    directory. On restart the snapshot is loaded and only the stored blocks
+    above its height are applied; the whole chain is replayed only if the
+    snapshot is missing, damaged or no longer matches the stored chain.
+
+    A block is a list of (sender, recipient, value) transfers; a sender of
+    None mints value, as the genesis allocation does. On restart the index
+    is rebuilt by replaying the stored blocks, whose minted transfers carry
+    the empty sender.
+
+"""
+# import libraries
+import os
+import zlib
+import struct
+import threading
+import serialization
+
+SNAPSHOT_FILE = 'balances.dat'
+
+# snapshot header: magic, CRC-32 of the rest of the file, height covered,
+# raw hash of the block at height - 1 (zeros for height 0), address count;
+# each address follows as its length, raw bytes and balance
+_SNAPSHOT = struct.Struct('>4sIQ32sI')
+_SNAPSHOT_MAGIC = b'UBBL'
+_ENTRY = struct.Struct('>q')
+
+
+class InsufficientFunds(ValueError):
+    pass
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+# the transfers of a block's transactions, which carry the sender client,
+# recipient address, value and minted flag of the blockchain scripts
+def block_transfers(transactions):
+    return [(None if t.minted else t.sender.identity, t.recipient, t.value)
+            for t in transactions]
+
+# the transfers of a block in the serialization encoding; the empty sender
+# of a minted transfer decodes to None
+def decode_transfers(encoded_block):
+    transfers = []
+    for encoded in serialization.decode_block(encoded_block)[3]:
+        (sender, recipient, value, timestamp) = serialization.decode_payload(
+            serialization.decode_transaction(encoded)[0])
+        transfers.append((serialization.bytes_to_hex(sender), serialization.bytes_to_hex(recipient), value))
+    return transfers
+
+
+class BalanceIndex:
+    def __init__(self):
+        self.height = 0
+        self._balances = {}
+        self._lock = threading.Lock()
+
+    def balance(self, address):
+        with self._lock:
+            return self._balances.get(address, 0)
+
+    def can_spend(self, address, value):
+        with self._lock:
+            return value >= 0 and self._balances.get(address, 0) >= value
+
+    # whether each transfer can be applied in order on top of the current
+    # balances and the transfers accepted before it, which rules out
+    # overdrafts and double spends; O(1) per transfer
+    def spendable(self, transfers):
+        with self._lock:
+            spent = {}
+            return [self._spend(spent, transfer) for transfer in transfers]
+
+    # the running balance deltas are kept in spent, so later transfers in
+    # the same block see the earlier ones
+    def _spend(self, spent, transfer):
+        (sender, recipient, value) = transfer
+        if value < 0:
+            return False
+        if sender is not None:
+            available = self._balances.get(sender, 0) + spent.get(sender, 0)
+            if available < value:
+                return False
+            spent[sender] = spent.get(sender, 0) - value
+        spent[recipient] = spent.get(recipient, 0) + value
+        return True
+
+    # apply the transfers of the next block; with check, raises
+    # InsufficientFunds and changes nothing if any of them overdraws, without
+    # (e.g. replaying blocks validated when they were first appended) applies
+    # them as they are
+    def apply_block(self, transfers, check=True):
+        with self._lock:
+            spent = {}
+            for transfer in transfers:
+                if not self._spend(spent, transfer):
+                    if check:
+                        raise InsufficientFunds("transfer of " + str(transfer[2]) + " from "
+                                                + str(transfer[0]) + " overdraws its balance")
+                    (sender, recipient, value) = transfer
+                    if sender is not None:
+                        spent[sender] = spent.get(sender, 0) - value
+                    spent[recipient] = spent.get(recipient, 0) + value
+            for (address, delta) in spent.items():
+                balance = self._balances.get(address, 0) + delta
+                if balance:
+                    self._balances[address] = balance
+                else:
+                    self._balances.pop(address, None)
+            self.height += 1
+
+    # apply every block of an iterable of encoded blocks (e.g. a chain
+    # store), each checked as apply_block does
+    def replay(self, encoded_blocks):
+        for encoded_block in encoded_blocks:
+            self.apply_block(decode_transfers(encoded_block))
+
+    def _snapshot_path(self, store):
+        return os.path.join(store.directory, SNAPSHOT_FILE)
+
+    # write the balances and the height they cover next to store, whose
+    # blocks below that height they must include; written to a temporary
+    # file and renamed, so a crash leaves the old snapshot or the new one
+    def save(self, store):
+        with self._lock:
+            tip = bytes.fromhex(store.hash_at(self.height - 1)) if self.height else bytes(32)
+            body = bytearray()
+            for (address, balance) in self._balances.items():
+                raw = bytes.fromhex(address)
+                body.append(len(raw))
+                body += raw
+                body += _ENTRY.pack(balance)
+            header = _SNAPSHOT.pack(_SNAPSHOT_MAGIC, 0, self.height, tip, len(self._balances))
+            crc = zlib.crc32(body, zlib.crc32(header[8:]))
+            path = self._snapshot_path(store)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(_SNAPSHOT.pack(_SNAPSHOT_MAGIC, crc, self.height, tip, len(self._balances)))
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+    # the (height, raw tip hash, balances) of a snapshot file
+    @staticmethod
+    def _load(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _SNAPSHOT.size:
+            raise SnapshotError("truncated balance snapshot")
+        (magic, crc, height, tip, count) = _SNAPSHOT.unpack_from(data, 0)
+        if magic != _SNAPSHOT_MAGIC or zlib.crc32(data[8:]) != crc:
+            raise SnapshotError("damaged balance snapshot")
+        balances = {}
+        offset = _SNAPSHOT.size
+        for i in range(count):
+            length = data[offset]
+            address = data[offset + 1:offset + 1 + length].hex()
+            (balances[address],) = _ENTRY.unpack_from(data, offset + 1 + length)
+            offset += 1 + length + _ENTRY.size
+        return (height, tip, balances)
+
+    # bring an empty index up to date with store from the snapshot saved
+    # next to it, applying only the blocks above the snapshot's height;
+    # returns the number of blocks applied
+    def restore(self, store):
+        with self._lock:
+            try:
+                (height, tip, balances) = self._load(self._snapshot_path(store))
+            except (OSError, SnapshotError, struct.error, IndexError):
+                (height, tip, balances) = (0, None, {})
+            # a snapshot of a chain the store no longer holds is of no use
+            if height > len(store) or (height and bytes.fromhex(store.hash_at(height - 1)) != tip):
+                (height, balances) = (0, {})
+            self._balances = balances
+            self.height = height
+        self.replay(store.get(h) for h in range(height, len(store)))
+        return len(store) - height
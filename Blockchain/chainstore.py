@@ -0,0 +1,344 @@
+"""
+
+Blockchain Chain Store:
+
+    Append-only on-disk block store shared by the blockchain scripts
+
+    Encoded blocks are appended to numbered segment files, each record
+    carrying its length, CRC-32 and block hash. A fixed-size index file maps
+    height to (segment, offset, length, hash) and is loaded on open into
+    compact arrays, with a dict from block hash to height; block contents
+    stay on disk and are read through read-only memory maps of the segments,
+    so scanning the chain only pages in the blocks it reads. Only the maps of
+    the max_maps most recently read segments are kept, which bounds the
+    resident size of a full scan by the segment size, not the chain length.
+
+    Records reach the OS on every append and are fsynced every sync_every
+    appends (and on sync() and close()). On open, a torn tail left by a crash
+    is cut off and blocks written to a segment but missing from the index are
+    re-indexed from their record headers.
+
+"""
+# import libraries
+import os
+import zlib
+import mmap
+import array
+import struct
+import threading
+import collections
+import serialization
+
+# segment record header: magic, data length, CRC-32 of the data, block hash
+_RECORD = struct.Struct('>4sII32s')
+_MAGIC = b'UBBK'
+# index record: segment number, record offset, data length, block hash
+_INDEX = struct.Struct('>IQI32s')
+
+_INDEX_FILE = 'index.dat'
+
+
+def _segment_name(segment):
+    return 'blocks-%06d.dat' % segment
+
+
+class ChainStoreError(Exception):
+    pass
+
+
+class ChainStore:
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, sync_every=64, max_maps=2):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.max_maps = max_maps
+        self._lock = threading.RLock()
+        self._segments = array.array('I')
+        self._offsets = array.array('Q')
+        self._lengths = array.array('I')
+        self._hashes = bytearray()
+        self._heights = {}
+        self._maps = collections.OrderedDict()
+        self._unsynced = 0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._index = open(os.path.join(directory, _INDEX_FILE), 'ab')
+        self._segment = self._segment_count() - 1 if self._segment_count() else 0
+        self._writer = open(self._path(self._segment), 'ab')
+
+    def _path(self, segment):
+        return os.path.join(self.directory, _segment_name(segment))
+
+    def _segment_count(self):
+        count = 0
+        while os.path.exists(self._path(count)):
+            count += 1
+        return count
+
+    def _add_entry(self, segment, offset, length, block_hash):
+        self._heights[block_hash] = len(self._segments)
+        self._segments.append(segment)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._hashes += block_hash
+
+    def _drop_entries(self, height):
+        for i in range(height, len(self._segments)):
+            del self._heights[bytes(self._hashes[32 * i:32 * i + 32])]
+        del self._segments[height:]
+        del self._offsets[height:]
+        del self._lengths[height:]
+        del self._hashes[32 * height:]
+
+    # the header of the record at offset of an open segment file, or None if
+    # it is torn or corrupt
+    @staticmethod
+    def _read_record(f, offset, size):
+        if offset + _RECORD.size > size:
+            return None
+        f.seek(offset)
+        (magic, length, crc, block_hash) = _RECORD.unpack(f.read(_RECORD.size))
+        if magic != _MAGIC or offset + _RECORD.size + length > size:
+            return None
+        if zlib.crc32(f.read(length)) != crc:
+            return None
+        return (length, block_hash)
+
+    def _recover(self):
+        index_path = os.path.join(self.directory, _INDEX_FILE)
+        entries = 0
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            entries = len(data) // _INDEX.size
+            for (segment, offset, length, block_hash) in _INDEX.iter_unpack(data[:entries * _INDEX.size]):
+                self._add_entry(segment, offset, length, block_hash)
+        dirty = os.path.exists(index_path) and os.path.getsize(index_path) != entries * _INDEX.size
+        segments = self._segment_count()
+        # drop index entries whose records did not survive
+        while len(self._segments):
+            height = len(self._segments) - 1
+            segment = self._segments[height]
+            if segment < segments:
+                with open(self._path(segment), 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if self._read_record(f, self._offsets[height], size) is not None:
+                        break
+            self._drop_entries(height)
+            dirty = True
+        # index records written to the segments after the last indexed one
+        if len(self._segments):
+            segment = self._segments[-1]
+            offset = self._offsets[-1] + _RECORD.size + self._lengths[-1]
+        else:
+            (segment, offset) = (0, 0)
+        while segment < segments:
+            with open(self._path(segment), 'r+b') as f:
+                size = os.fstat(f.fileno()).st_size
+                while True:
+                    record = self._read_record(f, offset, size)
+                    if record is None:
+                        break
+                    self._add_entry(segment, offset, record[0], record[1])
+                    offset += _RECORD.size + record[0]
+                    dirty = True
+                if offset < size:
+                    # torn tail: nothing after it can be trusted
+                    f.truncate(offset)
+                    break
+            segment += 1
+            offset = 0
+        for stale in range(segment + 1, segments):
+            os.remove(self._path(stale))
+        # rewrite the index if it was torn or lost or gained entries
+        if dirty:
+            with open(index_path, 'wb') as f:
+                for height in range(len(self._segments)):
+                    f.write(self._index_record(height))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _index_record(self, height):
+        return _INDEX.pack(self._segments[height], self._offsets[height], self._lengths[height],
+                           bytes(self._hashes[32 * height:32 * height + 32]))
+
+    # append an encoded block with the given hex hash; returns its height
+    def append(self, data, block_hash):
+        raw_hash = bytes.fromhex(block_hash)
+        if len(raw_hash) != 32:
+            raise ChainStoreError("block hash must be 32 bytes")
+        with self._lock:
+            if raw_hash in self._heights:
+                raise ChainStoreError("block " + block_hash + " is already stored")
+            offset = self._writer.tell()
+            if offset > 0 and offset + _RECORD.size + len(data) > self.segment_size:
+                self._writer.flush()
+                os.fsync(self._writer.fileno())
+                self._writer.close()
+                self._segment += 1
+                self._writer = open(self._path(self._segment), 'ab')
+                offset = 0
+            self._writer.write(_RECORD.pack(_MAGIC, len(data), zlib.crc32(data), raw_hash))
+            self._writer.write(data)
+            self._writer.flush()
+            self._add_entry(self._segment, offset, len(data), raw_hash)
+            self._index.write(self._index_record(len(self._segments) - 1))
+            self._index.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self.sync()
+            return len(self._segments) - 1
+
+    # force the appended blocks to disk, segments before the index
+    def sync(self):
+        with self._lock:
+            os.fsync(self._writer.fileno())
+            os.fsync(self._index.fileno())
+            self._unsynced = 0
+
+    # a read-only map of the segment covering at least its first end bytes;
+    # the segment being appended to is remapped once it outgrows its map
+    def _map(self, segment, end):
+        m = self._maps.pop(segment, None)
+        if m is None or len(m) < end:
+            if m is not None:
+                m.close()
+            with open(self._path(segment), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            while len(self._maps) >= self.max_maps:
+                self._maps.popitem(last=False)[1].close()
+        self._maps[segment] = m
+        return m
+
+    def _close_maps(self):
+        for m in self._maps.values():
+            m.close()
+        self._maps = collections.OrderedDict()
+
+    # the encoded block at height (negative heights count from the tip), or
+    # only its first limit bytes, e.g. to decode a header without paging in
+    # the whole block
+    def get(self, height, limit=None):
+        with self._lock:
+            if height < 0:
+                height += len(self._segments)
+            if not 0 <= height < len(self._segments):
+                raise IndexError("block height out of range")
+            start = self._offsets[height] + _RECORD.size
+            end = start + self._lengths[height]
+            if limit is not None:
+                end = min(end, start + limit)
+            return self._map(self._segments[height], end)[start:end]
+
+    def hash_at(self, height):
+        with self._lock:
+            if height < 0:
+                height += len(self._segments)
+            if not 0 <= height < len(self._segments):
+                raise IndexError("block height out of range")
+            return self._hashes[32 * height:32 * height + 32].hex()
+
+    # the height of the block with the given hex hash, or None
+    def height_of(self, block_hash):
+        with self._lock:
+            return self._heights.get(bytes.fromhex(block_hash))
+
+    # remove the blocks at height and above, e.g. to switch to a peer chain
+    def truncate(self, height):
+        with self._lock:
+            if height >= len(self._segments):
+                return
+            height = max(height, 0)
+            segment = self._segments[height]
+            offset = self._offsets[height]
+            self._drop_entries(height)
+            self._close_maps()
+            self._writer.close()
+            for stale in range(segment + 1, self._segment_count()):
+                os.remove(self._path(stale))
+            with open(self._path(segment), 'r+b') as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+            self._index.truncate(height * _INDEX.size)
+            self._index.seek(0, os.SEEK_END)
+            os.fsync(self._index.fileno())
+            self._segment = segment
+            self._writer = open(self._path(segment), 'ab')
+
+    # truncate to height and append the (data, hex hash) blocks as one step,
+    # so no reader sees the chain between the two
+    def replace(self, height, blocks):
+        with self._lock:
+            self.truncate(height)
+            for (data, block_hash) in blocks:
+                self.append(data, block_hash)
+
+    # the encoded blocks of the whole chain as of one moment, unlike iterating,
+    # which another thread's truncate or replace can cut short or mix up
+    def snapshot(self):
+        with self._lock:
+            return [self.get(height) for height in range(len(self._segments))]
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self.get(height)
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            self._writer.close()
+            self._index.close()
+            self._close_maps()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# read-only sequence view of the stored blocks, decoding each block with
+# decode(data) only when it is accessed
+class BlockSequence:
+    def __init__(self, store, decode):
+        self.store = store
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.store)
+
+    # hex hash of the block at index, from the store index
+    def hash_at(self, index):
+        return self.store.hash_at(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.decode(self.store.get(index))
+
+    # the decoded blocks of a consistent snapshot of the store
+    def snapshot(self):
+        return [self.decode(data) for data in self.store.snapshot()]
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+
+# walk a store of blocks in the serialization encoding, reading only their
+# headers through the memory maps, so the scan stays flat in memory for any
+# chain length; returns the total transaction count and whether every block
+# links to the hash of the one before it
+def scan_headers(store):
+    transactions = 0
+    links_valid = True
+    for height in range(len(store)):
+        header = store.get(height, serialization.MAX_BLOCK_HEADER_SIZE)
+        (previous_hash, nonce, merkle_root, count, offset) = serialization.decode_block_header(header)
+        if height > 0 and serialization.bytes_to_hex(previous_hash) != store.hash_at(height - 1):
+            links_valid = False
+        transactions += count
+    return (transactions, links_valid)
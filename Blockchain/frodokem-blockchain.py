@@ -14,30 +14,109 @@ Blockchain Testing:
 # import libraries
 import sys
 import hashlib
-import binascii
 import datetime
 import collections
+import threading
+import mining
+import addresses
+import balances
+import chainstore
+import mempool
+import merkle
+import serialization
+import verification
 from frodokem import frodokem
 
+# nonce search engine used by mine()
+MINER = mining.Miner()
+
+# cache of public matrices A shared by every FrodoKEM instance in this node,
+# so signing and verifying against a known key does not regenerate A
+A_CACHE = frodokem.MatrixCache(max_bytes=64 * 1024 * 1024)
+
+# FrodoKEM matrix backend of new clients: numpy, an optional dependency, if
+# it is installed, else the pure-Python reference code
+DEFAULT_BACKEND = 'numpy' if frodokem.numpy is not None else 'python'
+
+# one FrodoKEM engine per (variant, backend), shared by all clients and
+# transactions so its parameters and caches survive between calls
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_kem(matrix_variant, backend):
+    with _engines_lock:
+        kem = _engines.get((matrix_variant, backend))
+        if kem is None:
+            kem = frodokem.FrodoKEM(matrix_variant, backend, A_CACHE)
+            _engines[(matrix_variant, backend)] = kem
+        return kem
+
+# number of identity, to_dict, payload and hash recomputations avoided by the
+# values memoized on clients and transactions
+MEMO_HITS = collections.Counter()
+
+# directory of the on-disk chain, kept across runs
+CHAIN_DIRECTORY = 'ubcoins-frodokem'
+
+# size limit of the transactions taken from the mempool into one block
+MAX_BLOCK_BYTES = 1024 * 1024
+
+# balance of every address on the stored chain, kept up to date as blocks
+# are appended
+BALANCES = balances.BalanceIndex()
+
+# full public keys of the known addresses, looked up when verifying
+KEYS = addresses.KeyRegistry()
 
 # 1. Client class
 class Client:
-    def __init__(self, matrix_variant='AES'):
+    def __init__(self, matrix_variant='AES', backend=DEFAULT_BACKEND):
         self._matrix_variant = 'FrodoKEM-640-'+matrix_variant
-        self.kem = frodokem.FrodoKEM(self._matrix_variant)
+        self._backend = backend
+        self.kem = get_kem(self._matrix_variant, self._backend)
         (self._private_key, self._public_key) = self.kem.kem_keygen()
+        # the keys prepared once for the encapsulations made when signing and
+        # the decapsulations made when verifying this client's transactions
+        self._prepared_private_key = self.kem.prepare_public_key(self._private_key)
+        self._prepared_public_key = self.kem.prepare_secret_key(self._public_key)
+        KEYS.register(self._public_key)
+        self._identity = None
         
+    # short address of the key, the only part of it carried by transactions;
+    # computed on first use
     @property
     def identity(self):
-        return binascii.hexlify(self._public_key).decode('ascii')
+        if self._identity is None:
+            self._identity = addresses.address_of(self._public_key)
+        else:
+            MEMO_HITS['identity'] += 1
+        return self._identity
     
 # 2. Transaction class
 class Transaction:
-    def __init__(self, sender, recipient, value):
+    # fields covered by to_dict() and payload(); setting one drops both
+    # memoized values
+    _PAYLOAD_FIELDS = ('sender', 'recipient', 'value', 'time', 'minted')
+    # fields covered by hash(), the transaction's mempool key, which is
+    # memoized too
+    _HASH_FIELDS = _PAYLOAD_FIELDS + ('cypher_text', 'hashed_message')
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in Transaction._PAYLOAD_FIELDS:
+            object.__setattr__(self, '_dict', None)
+            object.__setattr__(self, '_payload', None)
+        if name in Transaction._HASH_FIELDS:
+            object.__setattr__(self, '_hash', None)
+
+    # a minted transaction creates the value it sends; its payload carries
+    # the empty genesis sender, though the sender client still signs it
+    def __init__(self, sender, recipient, value, minted=False):
         self.sender = sender
         self.recipient = recipient
         self.value = value
-        self.time = datetime.datetime.now()
+        self.minted = minted
+        self.time = serialization.now()
         self.cypher_text = ""
         self.hashed_message = ""
         self.sign_time_start = 0
@@ -48,33 +127,64 @@ class Transaction:
         self.verify_time_duration = 0
         
     def to_dict(self):
-        if self.sender == "Genesis":
+        if self._dict is not None:
+            MEMO_HITS['to_dict'] += 1
+            return self._dict
+        if self.minted or self.sender == "Genesis":
             identity = "Genesis"
         else:
             identity = self.sender.identity
             
-        return collections.OrderedDict({
+        self._dict = collections.OrderedDict({
             'sender':identity,
             'recipient':self.recipient,
             'value':self.value,
             'time':self.time})
+        return self._dict
     
+    # canonical binary encoding of the signed fields
+    def payload(self):
+        if self._payload is not None:
+            MEMO_HITS['payload'] += 1
+            return self._payload
+        if self.minted or self.sender == "Genesis":
+            sender = b''
+        else:
+            sender = serialization.hex_to_bytes(self.sender.identity)
+        self._payload = serialization.encode_payload(sender, serialization.hex_to_bytes(self.recipient),
+                                                     self.value, self.time)
+        return self._payload
+
+    # SHA-256 of the signed transaction, as a hex string; the key of the
+    # transaction in the mempool
+    def hash(self):
+        if self._hash is not None:
+            MEMO_HITS['hash'] += 1
+            return self._hash
+        self._hash = serialization.hash_hex(self.serialize())
+        return self._hash
+
+    # canonical binary encoding of the signed transaction
+    def serialize(self):
+        return serialization.encode_transaction(
+            self.payload(), [self.cypher_text, serialization.hex_to_bytes(self.hashed_message)])
+
     def sign_transaction(self):
         self.sign_time_start = datetime.datetime.now().timestamp()*1000
-        private_key = self.sender._private_key
-        (ct, ss_e) = frodokem.FrodoKEM(self.sender._matrix_variant).kem_encaps(private_key)
+        private_key = self.sender._prepared_private_key
+        (ct, ss_e) = get_kem(self.sender._matrix_variant, self.sender._backend).kem_encaps(private_key)
         self.cypher_text = ct
-        self.hashed_message = sha256_1(str(ss_e)+str(self.to_dict()))
+        self.hashed_message = sha256_1(ss_e + self.payload())
         self.sign_time_end = datetime.datetime.now().timestamp()*1000
         self.sign_time_duration = self.sign_time_end - self.sign_time_start
 
     def verify_transaction(self, public_key,cypher_text,transaction_info):
         self.verify_time_start = datetime.datetime.now().timestamp()*1000
-        ss_d = frodokem.FrodoKEM(self.sender._matrix_variant).kem_decaps(public_key,cypher_text)
-        hashed_transaction_info = sha256_1(str(ss_d)+transaction_info)
+        isValid = check_signature(self.sender._matrix_variant, self.sender._backend,
+                                  public_key, cypher_text, transaction_info, self.hashed_message)
         self.verify_time_end = datetime.datetime.now().timestamp()*1000
         self.verify_time_duration = self.verify_time_end - self.verify_time_start
-        return (hashed_transaction_info==self.hashed_message)
+        return (isValid)
 
 # 3. Block class
 class Block:
@@ -83,6 +193,75 @@ class Block:
         self.previous_block_hash = ""
         self.Nonce = ""
 
+    # Merkle tree over the raw transaction hashes, in block order
+    def merkle_tree(self):
+        return merkle.MerkleTree([bytes.fromhex(t.hash()) for t in self.verified_transactions])
+
+    # canonical binary encoding of the block header
+    def header(self):
+        return serialization.encode_block_header(serialization.hex_to_bytes(self.previous_block_hash),
+                                                 serialization.hex_to_bytes(self.Nonce),
+                                                 self.merkle_tree().root,
+                                                 len(self.verified_transactions))
+
+    # canonical binary encoding of the block
+    def serialize(self):
+        return serialization.encode_block(serialization.hex_to_bytes(self.previous_block_hash),
+                                          serialization.hex_to_bytes(self.Nonce),
+                                          self.merkle_tree().root,
+                                          [t.serialize() for t in self.verified_transactions])
+
+    # SHA-256 of the canonical header encoding, as a hex string
+    def hash(self):
+        return serialization.hash_hex(self.header())
+
+    # proof that the transaction at index is in the block, checked against
+    # the Merkle root in its header with merkle.verify_proof
+    def inclusion_proof(self, index):
+        return self.merkle_tree().proof(index)
+
+
+# function to check a transaction signature over its payload (public_key may
+# be the raw key bytes or a prepared key)
+def check_signature(matrix_variant, backend, public_key, cypher_text, transaction_info, hashed_message):
+    ss_d = get_kem(matrix_variant, backend).kem_decaps(public_key,cypher_text)
+    hashed_transaction_info = sha256_1(ss_d + transaction_info)
+    return (hashed_transaction_info==hashed_message)
+
+# keys prepared by a worker process for decapsulation, by (variant, backend,
+# raw key)
+def _prepare_key(cache_key):
+    (matrix_variant, backend, key) = cache_key
+    return get_kem(matrix_variant, backend).prepare_secret_key(key)
+
+_prepared_keys = verification.KeyCache(_prepare_key)
+
+def _verify_worker(job):
+    (matrix_variant, backend, public_key, cypher_text, transaction_info, hashed_message) = job
+    return check_signature(matrix_variant, backend, _prepared_keys.get((matrix_variant, backend, public_key)),
+                           cypher_text, transaction_info, hashed_message)
+
+# only plain bytes and strings are sent to the workers, which decapsulate
+# with their own engines; the full keys are looked up by sender address,
+# and a sender whose key cannot be resolved fails verification
+def _verify_job(t):
+    public_key = KEYS.get(t.sender.identity)
+    if public_key is None:
+        return None
+    return (t.sender._matrix_variant, t.sender._backend, public_key,
+            t.cypher_text, t.payload(), t.hashed_message)
+
+# function to verify transactions in parallel over a pool of worker processes;
+# returns the verdicts in transaction order. If needed is given, stops once that
+# many transactions are valid and leaves the unchecked verdicts as None
+def verify_batch(transactions, workers=None, needed=None):
+    return verification.verify_batch(transactions, _verify_job, _verify_worker, workers, needed)
+
+# function to queue a signed transaction in the mempool, under its hash and
+# sender address; returns False for a duplicate
+def submit_transaction(pool, transaction):
+    return pool.add(transaction.hash(), transaction, transaction.sender.identity,
+                    len(transaction.serialize()))
 
 # function to display transactions    
 def display_transaction(transaction):
@@ -91,7 +270,7 @@ def display_transaction(transaction):
     print("sender: " + str(dict['sender'])[-25:])
     print("recipient: " + str(dict['recipient'])[-25:])
     print("value: " + str(dict['value'])[-25:])
-    print("time: " + str(dict['time']))
+    print("time: " + serialization.format_timestamp(dict['time']))
 
 # function to dump the transaction onto Blockchain    
 def dump_blockchain(UBCoins, matrix_variant):
@@ -115,23 +294,29 @@ def dump_blockchain(UBCoins, matrix_variant):
     print ("Matrix Variant: ",matrix_variant)
     print ("Average Sign Time: ",(total_sign_time/counter))
     print ("Average Verify Time: ",(total_verify_time/counter))
+    for address in sorted({t.recipient for block in UBCoins for t in block.verified_transactions}):
+        print ("Balance of " + address[-25:] + ": ", BALANCES.balance(address))
+    print ("Memoized Identity/to_dict/Payload/Hash Recomputations Avoided: ",
+           MEMO_HITS['identity'], "/", MEMO_HITS['to_dict'], "/", MEMO_HITS['payload'], "/", MEMO_HITS['hash'])
+    print ("A Matrix Cache Hits/Misses: ", A_CACHE.hits, "/", A_CACHE.misses)
 
 def sha256_1(message):
-    return hashlib.sha256(message.encode('ascii')).hexdigest()
+    return hashlib.sha256(message).hexdigest()
 
-# function to mine the block
+# function to mine the block with the given hex hash, scanning the nonces on
+# all cores
 def mine(message, difficulty = 1):
     assert difficulty >= 1
     prefix = '1' * difficulty
-    for i in range(10000000):
-        digest = sha256_1(str(hash(message)) + str(i))
-        if digest.startswith(prefix):
-            print("after " + str(i) + " iterations found nonce: " + digest)
-        return digest
+    result = MINER.mine(mining.scan_prefix, (message, prefix), limit=10000000)
+    if result.nonce is not None:
+        print("after " + str(result.nonce) + " iterations found nonce: " + result.digest)
+    print("mining rate: " + str(int(result.hash_rate)) + " hashes/s over " + str(MINER.workers) + " processes")
+    return result.digest
 
 def main():
     sender_list = []
-    transactions = []
+    transactions = mempool.Mempool()
     UBCoins = []
     matrix_variant = input("Enter Matrix Variant 'AES' or 'SHAKE': ").upper()
     
@@ -144,21 +329,20 @@ def main():
     sender_list = [Peter,Arzu,Sathia,Professor]
     
     # transactions
-    t0 = Transaction(Genesis, Peter.identity, 5000)
+    t0 = Transaction(Genesis, Peter.identity, 5000, minted=True)
     t0.sign_transaction()
-    transactions.append(t0)
     t1 = Transaction(Peter, Arzu.identity, 100)
     t1.sign_transaction()
-    transactions.append(t1)
+    submit_transaction(transactions, t1)
     t2 = Transaction(Peter, Sathia.identity, 150)
     t2.sign_transaction()
-    transactions.append(t2)
+    submit_transaction(transactions, t2)
     t3 = Transaction(Arzu, Sathia.identity, 75)
     t3.sign_transaction()
-    transactions.append(t3)
+    submit_transaction(transactions, t3)
     t4 = Transaction(Sathia, Professor.identity, 120)
     t4.sign_transaction()
-    transactions.append(t4)
+    submit_transaction(transactions, t4)
     
     # adding the genesis block
     block0 = Block()
@@ -166,37 +350,62 @@ def main():
     Nonce = None
     
     block0.verified_transactions.append(t0)
-    digest = hash(block0)
+    
+    # the genesis block funds this run's clients and extends the chain
+    # stored by earlier runs, whose balances are replayed once
+    store = chainstore.ChainStore(CHAIN_DIRECTORY)
+    replayed = BALANCES.restore(store)
+    if len(store) > 0:
+        block0.previous_block_hash = store.hash_at(-1)
+    digest = block0.hash()
     last_block_hash = digest
     
     UBCoins.append(block0)
+    store.append(block0.serialize(), digest)
+    BALANCES.apply_block(balances.block_transfers(block0.verified_transactions))
     
     # mining the next block (Block 1)
     block1 = Block()
-    last_transaction_index = 1
     
-    # mining the next 2 transactions in block 1
-    for i in range(4):
-        current_transaction = transactions[last_transaction_index]
-        public_key = current_transaction.sender._public_key
-        cypher_text = current_transaction.cypher_text
-        transaction_info = str(current_transaction.to_dict())
-
-        #verify_transaction(self, public_key,cypher_text,transaction_info,hashed_message):
-        if (current_transaction.verify_transaction(public_key,cypher_text,transaction_info)):
-            temp_transaction = current_transaction
-            # validate transaction, if valid
-            block1.verified_transactions.append(temp_transaction)
-            last_transaction_index += 1
+    # mining the next 4 transactions from the mempool in block 1, verified in
+    # parallel
+    pending = transactions.select_for_block(MAX_BLOCK_BYTES, max_count=4)
+    verdicts = verify_batch(pending, needed=4)
+    signed = []
+    for (current_transaction, verdict) in zip(pending, verdicts):
+        if verdict:
+            signed.append(current_transaction)
         else:
             print("Signature Error: Sender or Transaction Not Valid")
+    # validate transaction, if valid and covered by the sender's balance
+    # (including the earlier transactions of the block)
+    spendable = BALANCES.spendable(balances.block_transfers(signed))
+    for (current_transaction, verdict) in zip(signed, spendable):
+        if verdict:
+            block1.verified_transactions.append(current_transaction)
+        else:
+            print("Balance Error: Sender Cannot Cover Transaction")
 
     block1.previous_block_hash = last_block_hash
-    block1.Nonce = mine(block1, 2)
-    digest = hash(block1)
+    block1.Nonce = mine(block1.hash(), 2)
+    digest = block1.hash()
     
     UBCoins.append(block1)
+    store.append(block1.serialize(), digest)
+    BALANCES.apply_block(balances.block_transfers(block1.verified_transactions))
+    # every transaction's inclusion proof against the root in the header
+    leaves = [bytes.fromhex(t.hash()) for t in block1.verified_transactions]
+    proven = merkle.count_proven(block1.merkle_tree(), leaves,
+                                 serialization.decode_block_header(block1.header())[2])
+    print("Merkle Inclusion Proofs Verified: " + str(proven) + "/" + str(len(leaves)))
     last_block_hash = digest
+    print("Blocks stored in " + CHAIN_DIRECTORY + ": " + str(len(store)))
+    print("Blocks replayed into balances on start: " + str(replayed))
+    (stored_transactions, links_valid) = chainstore.scan_headers(store)
+    print ("Stored Blocks/Transactions: ", len(store), "/", stored_transactions)
+    print ("Stored Chain Links Valid: ", links_valid)
+    BALANCES.save(store)
+    store.close()
         
     # dump the blocks into the chain
     dump_blockchain(UBCoins, matrix_variant)
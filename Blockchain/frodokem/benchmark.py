@@ -0,0 +1,32 @@
+# Creative Commons Zero v1.0 Universal
+# SPDX-License-Identifier: CC0-1.0
+
+import array
+import frodokem
+import os
+import sys
+import timeit
+
+class Benchmark(object):
+
+    @staticmethod
+    def best_of(f, repeat = 5):
+        """Return the fastest of repeat single runs of f, in milliseconds"""
+        return 1000 * min(timeit.repeat(f, number = 1, repeat = repeat))
+
+    @staticmethod
+    def sampler(kem):
+        """Time sampling the nbar x n matrix S^T, element by element with sample()
+        as before, and in one pass with sample_matrix()"""
+        r = array.array('H', os.urandom(2 * kem.n * kem.nbar))
+        before = Benchmark.best_of(lambda: [[kem.sample(r[i * kem.n + j]) for j in range(kem.n)] for i in range(kem.nbar)])
+        after = Benchmark.best_of(lambda: kem.sample_matrix(r, kem.nbar, kem.n))
+        print("{:s} [{:s}] sample_matrix {:d} x {:d}: before {:.3f} ms, after {:.3f} ms".format(
+            kem.variant, kem.backend, kem.nbar, kem.n, before, after))
+
+if __name__ == "__main__":
+    # Benchmark each parameter set (the AES and SHAKE variants share T_chi), 
+    # optionally on a non-default backend, e.g. "python benchmark.py numpy"
+    backend = sys.argv[1] if len(sys.argv) > 1 else "python"
+    for variant in ['FrodoKEM-640-AES', 'FrodoKEM-976-AES', 'FrodoKEM-1344-AES']:
+        Benchmark.sampler(frodokem.FrodoKEM(variant, backend))
@@ -4,44 +4,167 @@
 # Reference: https://frodokem.org/
 # Original Source Source: https://github.com/microsoft/PQCrypto-LWEKE/tree/master/python3
 
-import bitstring
+import array
+import collections
 import secrets
 import struct
+import sys
+import threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+class MatrixCache(object):
+    """Least-recently-used cache of public matrices A = Frodo.Gen(seedA), keyed by 
+    (variant, backend, seedA) and bounded by an approximate memory budget in bytes. 
+    A single cache may be shared between FrodoKEM instances and threads."""
+
+    def __init__(self, max_bytes = 64 * 1024 * 1024):
+        """Construct a new cache holding at most max_bytes worth of matrices"""
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def __nbytes(A):
+        """Estimate the memory held by matrix A"""
+        if numpy is not None and isinstance(A, numpy.ndarray):
+            return A.nbytes
+        return sys.getsizeof(A) + len(A) * (sys.getsizeof(A[0]) + len(A[0]) * sys.getsizeof(A[0][-1]))
+
+    def get(self, key, gen):
+        """Return the matrix cached under key, calling gen() to produce and insert it 
+        on a miss. Matrices larger than the whole budget are returned but not cached."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # Generate outside the lock so that a miss does not stall other lookups
+        A = gen()
+        if numpy is not None and isinstance(A, numpy.ndarray): A.flags.writeable = False
+        size = MatrixCache.__nbytes(A)
+        with self.__lock:
+            if key not in self.__entries and size <= self.max_bytes:
+                self.__entries[key] = (A, size)
+                self.current_bytes += size
+                while self.current_bytes > self.max_bytes:
+                    (_, (_, evicted_size)) = self.__entries.popitem(last = False)
+                    self.current_bytes -= evicted_size
+                    self.evictions += 1
+        return A
+
+    def clear(self):
+        """Drop all cached matrices; the counters are kept"""
+        with self.__lock:
+            self.__entries.clear()
+            self.current_bytes = 0
+
+class PreparedPublicKey(object):
+    """A public key pk = seedA || b together with the values that kem_encaps derives 
+    from it, computed once by FrodoKEM.prepare_public_key so that repeated 
+    encapsulations against the same key can skip them."""
+
+    def __init__(self, variant, backend, pk, seedA, b, pkh, B, A):
+        self.variant = variant
+        self.backend = backend
+        self.pk = pk
+        self.seedA = seedA
+        self.b = b
+        # pkh = SHAKE(pk, len_pkh)
+        self.pkh = pkh
+        # B = Frodo.Unpack(b, n, nbar)
+        self.B = B
+        # A = Frodo.Gen(seedA), or None if A is fetched from the A-matrix cache or 
+        # generated in strips on every use
+        self.A = A
+
+class PreparedSecretKey(object):
+    """A secret key sk = (s || seedA || b, S^T, pkh) parsed once by 
+    FrodoKEM.prepare_secret_key, together with the values that kem_decaps derives 
+    from it, so that repeated decapsulations with the same key can skip them."""
+
+    def __init__(self, variant, backend, sk, s, seedA, b, Stransposed, S, pkh, B, A):
+        self.variant = variant
+        self.backend = backend
+        self.sk = sk
+        self.s = s
+        self.seedA = seedA
+        self.b = b
+        self.Stransposed = Stransposed
+        self.S = S
+        self.pkh = pkh
+        # B = Frodo.Unpack(b, n, nbar)
+        self.B = B
+        # A = Frodo.Gen(seedA), or None if A is fetched from the A-matrix cache or 
+        # generated in strips on every use
+        self.A = A
+
 class FrodoKEM(object):
     """Reference implementation of FrodoKEM, specification version TBD, 2020
     
     Note this specification is quite slow, as it is meant to be as close as possible
-    to a line-by-line mapping of the specification document to executable code."""
+    to a line-by-line mapping of the specification document to executable code.
+    
+    An instance keeps no per-call state, so a single instance (and its MatrixCache) 
+    can be shared by several threads."""
 
-    def __init__(self, variant = "FrodoKEM-640-AES"):
+    def __init__(self, variant = "FrodoKEM-640-AES", backend = "python", a_cache = None, strip_rows = None):
         """Construct a new FrodoKEM instance
         
-        - variant: One of FrodoKEM-{640,976,1344}-{AES,SHAKE}"""
+        - variant: One of FrodoKEM-{640,976,1344}-{AES,SHAKE}
+        - backend: "python" for the reference list-of-lists arithmetic, or "numpy" 
+          to hold matrices as uint16 ndarrays with wraparound mod-q arithmetic
+        - a_cache: optional MatrixCache used to reuse A across calls with the same seedA
+        - strip_rows: if given (and no a_cache is given), A is never materialized; it is 
+          generated strip_rows rows at a time and each strip is multiplied in immediately, 
+          keeping peak memory at O(n * nbar) instead of O(n^2)"""
         self.print_intermediate_values = False
         self.variant = variant
+        self.a_cache = a_cache
+        self.strip_rows = strip_rows
+        if backend == "numpy" and numpy is None:
+            raise ImportError("the numpy backend requires numpy to be installed")
+        assert backend in ["python", "numpy"], "Unknown backend"
+        self.backend = backend
         self.randombytes = lambda k : bytes((secrets.randbits(8) for i in range(k)))
         if variant == "FrodoKEM-640-AES":
             self.setParamsFrodo640()
             self.gen = self.genAES128
+            self.gen_rows = self.genAES128_rows
         elif variant == "FrodoKEM-640-SHAKE":
             self.setParamsFrodo640()
             self.gen = self.genSHAKE128
+            self.gen_rows = self.genSHAKE128_rows
         elif variant == "FrodoKEM-976-AES":
             self.setParamsFrodo976()
             self.gen = self.genAES128
+            self.gen_rows = self.genAES128_rows
         elif variant == "FrodoKEM-976-SHAKE":
             self.setParamsFrodo976()
             self.gen = self.genSHAKE128
+            self.gen_rows = self.genSHAKE128_rows
         elif variant == "FrodoKEM-1344-AES":
             self.setParamsFrodo1344()
             self.gen = self.genAES128
+            self.gen_rows = self.genAES128_rows
         elif variant == "FrodoKEM-1344-SHAKE":
             self.setParamsFrodo1344()
             self.gen = self.genSHAKE128
+            self.gen_rows = self.genSHAKE128_rows
         else:
             assert "Unknown variant"
 
@@ -192,13 +315,22 @@ class FrodoKEM(object):
         return shake_ctx.finalize()
 
     @staticmethod
-    def __aes128_16bytesonly(key, msg):
-        """Returns a bytes object containing the AES-128 encryption of the 16-byte 
-        message msg using the given key"""
+    def __aes128_ecb(key, msg):
+        """Returns a bytes object containing the AES-128 ECB encryption of msg, whose 
+        length is a multiple of 16 bytes, using the given key. The key schedule is 
+        set up once and all blocks are encrypted in a single call."""
         cipher_ctx = Cipher(algorithms.AES(key), modes.ECB(), backend = default_backend())
         encryptor_ctx = cipher_ctx.encryptor()
         return encryptor_ctx.update(msg) + encryptor_ctx.finalize()
 
+    @staticmethod
+    def __uint16_le(buf):
+        """Parse a bytes-like object as a sequence of 16-bit unsigned integers in 
+        little-endian byte order, in a single conversion"""
+        values = array.array('H', buf)
+        if sys.byteorder == 'big': values.byteswap()
+        return values
+
     @staticmethod
     def __cdf_zero_centred_symmetric(chi):
         """Converts a table of the form given in FrodoKEM specification Table 3 to 
@@ -211,8 +343,22 @@ class FrodoKEM(object):
             T_chi[z] = T_chi[0] + sum(chi[1:z + 1])
         return T_chi
 
+    def __matrix(self, X):
+        """Convert a list-of-lists matrix of (possibly negative) integers to the 
+        representation used by the selected backend. For the numpy backend this is 
+        a uint16 ndarray holding each entry modulo 2^16, which is congruent to the 
+        entry modulo q since q divides 2^16."""
+        if self.backend == "numpy":
+            return numpy.array(X, dtype = numpy.int64).astype(numpy.uint16)
+        return X
+
     def __matrix_mul(self, X, Y):
         """Compute matrix multiplication X * Y mod q"""
+        if self.backend == "numpy":
+            assert X.shape[1] == Y.shape[0], "Mismatched matrix dimensions"
+            # Products and sums wrap around modulo 2^32, which q divides
+            R = numpy.matmul(X.astype(numpy.uint32), Y.astype(numpy.uint32))
+            return (R & (self.q - 1)).astype(numpy.uint16)
         nrows_X = len(X)
         ncols_X = len(X[0])
         nrows_Y = len(Y)
@@ -228,6 +374,9 @@ class FrodoKEM(object):
 
     def __matrix_add(self, X, Y):
         """Compute matrix addition X + Y mod q"""
+        if self.backend == "numpy":
+            assert X.shape == Y.shape, "Mismatched matrix dimensions"
+            return (X + Y) & (self.q - 1)
         nrows_X = len(X)
         ncols_X = len(X[0])
         nrows_Y = len(Y)
@@ -237,6 +386,9 @@ class FrodoKEM(object):
 
     def __matrix_sub(self, X, Y):
         """Compute matrix subtraction X - Y mod q"""
+        if self.backend == "numpy":
+            assert X.shape == Y.shape, "Mismatched matrix dimensions"
+            return (X - Y) & (self.q - 1)
         nrows_X = len(X)
         ncols_X = len(X[0])
         nrows_Y = len(Y)
@@ -244,22 +396,26 @@ class FrodoKEM(object):
         assert ncols_X == ncols_Y and nrows_X == nrows_Y, "Mismatched matrix dimensions"
         return [[(X[i][j] - Y[i][j]) % self.q for j in range(ncols_X)] for i in range(nrows_X)]
     
+    def __matrix_columns(self, X, start, stop):
+        """Return the submatrix of X made of columns start, ..., stop - 1"""
+        if self.backend == "numpy":
+            return X[:, start:stop]
+        return [row[start:stop] for row in X]
+
+    def __matrix_vstack(self, Xs):
+        """Stack the rows of the matrices in Xs into a single matrix"""
+        if self.backend == "numpy":
+            return numpy.vstack(Xs)
+        return [row for X in Xs for row in X]
+
     def __matrix_transpose(self, X):
         """Compute transpose of matrix X"""
+        if self.backend == "numpy":
+            return numpy.ascontiguousarray(X.T)
         nrows = len(X)
         ncols = len(X[0])
         return [[X[j][i] for j in range(nrows)] for i in range(ncols)]
 
-    @staticmethod
-    def __bytes_to_bit_array(B):
-        """Convert a byte array in little-endian format to a little-endian bit 
-        array"""
-        b = bitstring.BitArray(length=8*len(B))
-        for i in range(len(B)):
-            for l in range(8):
-                b.set((B[i] >> l) % 2, 8*i+l)
-        return b
-
     @staticmethod
     def __ctverify(a, b):
         """Compares two equal-length matrices of integers; returns True if equal, False if any element differs.
@@ -274,6 +430,13 @@ class FrodoKEM(object):
                 r = r | (a[i][j] ^ b[i][j])
         return r == 0
 
+    @staticmethod
+    def __ctverify_array(a, b):
+        """Compares two equal-shape ndarrays; returns True if equal, False if any element 
+        differs. Like __ctverify, this accumulates the OR of all differences rather than 
+        stopping at the first mismatch."""
+        return int(numpy.bitwise_or.reduce(a ^ b, axis = None)) == 0
+
     @staticmethod
     def __ctselect(a, b, selector):
         """Select one of two equal-length byte arrays. If selector True, use a, else use b."""
@@ -288,86 +451,109 @@ class FrodoKEM(object):
     def encode(self, k):
         """Encode a bitstring (represented in Python as a bytes object) as a mod-q 
         integer matrix (FrodoKEM specification, Algorithm 1)"""
-        l = self.B * self.mbar * self.nbar
         K = [[0 for j in range(self.nbar)] for i in range(self.mbar)]
-        kbits = FrodoKEM.__bytes_to_bit_array(k)
+        # k as a little-endian integer, so that bit l of k is (kint >> l) & 1
+        kint = int.from_bytes(k, 'little')
+        mask = (1 << self.B) - 1
         # 1. for i = 0; i < mbar; i += 1
         for i in range(self.mbar):
             # 2. for j = 0; j < nbar; j += 1
             for j in range(self.nbar):
                 # 3. tmp = sum_{l=0}^{B-1} k_{(i*nbar+j)*B+l} 2^l
-                tmp = 0
-                for l in range(self.B):
-                    if kbits[(i * self.nbar + j) * self.B + l]: tmp += 2 ** l
+                tmp = (kint >> ((i * self.nbar + j) * self.B)) & mask
                 # 4. K[i][j] = ec(tmp) = tmp * q/2^B
-                K[i][j] = tmp * int(self.q / (2 ** self.B))
-        return K
-    
-    @staticmethod
-    def __bit_array_to_bytes(b):
-        """Convert a little-endian bit array to a byte array in little-endian format"""
-        B = bytearray(int(len(b)/8))
-        for i in range(len(B)):
-            for l in range(8):
-                if b[8*i+l]: B[i] |= 1 << l
-        return bytes(B)
+                K[i][j] = tmp * (self.q >> self.B)
+        return self.__matrix(K)
     
     def decode(self, K):
         """Decode a mod-q integer matrix into a bitstring (represented in Python 
         as a bytes object) (FrodoKEM specification, Algorithm 2)"""
-        k = bitstring.BitArray(length=self.B * self.mbar * self.nbar)
+        if self.backend == "numpy": K = K.tolist()
+        # k is accumulated as a little-endian integer, so that bit l of k is (kint >> l) & 1
+        kint = 0
         # 1. for i = 0; i < mbar; i += 1
         for i in range(self.mbar):
             # 2. for j = 0; j < nbar; j += 1
             for j in range(self.nbar):
                 # 3. tmp = dc(K[i][j]) = round(K[i][j] * 2^B / q) mod 2^B
                 tmp = round(K[i][j] * (2 ** self.B) / self.q) % (2 ** self.B)
-                # 4. tmp' = sum_{l=0}^{B-1} tmp_l * 2^l
-                tmpbits = [0 for l in range(self.B)]
-                for l in range(self.B):
-                    tmpbits[l] = tmp % 2
-                    tmp >>= 1
-                # 5. for l = 0; l < B; l += 1
-                for l in range(self.B):
-                    # 6. k[(i*nbar+j)*B+l] = tmpbits[l]
-                    k.set(tmpbits[l], (i * self.nbar + j) * self.B + l)
-        return FrodoKEM.__bit_array_to_bytes(k)
+                # 4.-6. k[(i*nbar+j)*B+l] = tmp_l for l = 0, ..., B-1
+                kint |= tmp << ((i * self.nbar + j) * self.B)
+        return kint.to_bytes(self.B * self.mbar * self.nbar // 8, 'little')
+
+    @staticmethod
+    def __pack_words(values, D):
+        """Pack a sequence of D-bit integers (D <= 16) into bytes as consecutive 
+        big-endian D-bit fields. For D = 16 this is a byte swap; otherwise each group 
+        of 8 values is combined into one integer and emitted as D bytes."""
+        if D == 16:
+            words = array.array('H', values)
+            if sys.byteorder == 'little': words.byteswap()
+            return words.tobytes()
+        out = bytearray()
+        for i in range(0, len(values), 8):
+            group = values[i:i + 8]
+            acc = 0
+            for x in group:
+                acc = (acc << D) | x
+            # A short final group is padded with zero bits to a whole byte
+            nbits = D * len(group)
+            acc <<= -nbits % 8
+            out += acc.to_bytes((nbits + 7) // 8, 'big')
+        return bytes(out)
+
+    @staticmethod
+    def __unpack_words(b, count, D):
+        """Inverse of __pack_words: parse count big-endian D-bit fields from b"""
+        if D == 16:
+            words = array.array('H', b[0 : 2 * count])
+            if sys.byteorder == 'little': words.byteswap()
+            return words.tolist()
+        mask = (1 << D) - 1
+        values = []
+        offset = 0
+        for i in range(0, count, 8):
+            size = min(8, count - i)
+            nbits = D * size
+            nbytes = (nbits + 7) // 8
+            acc = int.from_bytes(b[offset:offset + nbytes], 'big') >> (-nbits % 8)
+            offset += nbytes
+            values.extend([(acc >> (D * (size - 1 - k))) & mask for k in range(size)])
+        return values
 
     def pack(self, C):
         """Pack a matrix mod q into a bitstring (represented in Python as a bytes 
         object) (FrodoKEM specification, Algorithm 3)"""
-        n1 = len(C)
-        n2 = len(C[0])
-        b = bitstring.BitArray(self.D * n1 * n2)
         # 1. for i = 0; i < n1; i += 1
-        for i in range(n1):
-            # for j = 0; j < n2; j += 1
-            for j in range(n2):
-                # 3. Cij = sum_{l=0}^{D-1} c_l * 2^l
-                tmp = C[i][j]
-                c = [0 for l in range(self.D)]
-                for l in range(self.D):
-                    c[l] = tmp % 2
-                    tmp >>= 1
-                # 4. for l = 0; l < D; L += 1
-                for l in range(self.D):
-                    # 5. b[(i * n2 + j) * D + l] = c[D - 1 - l]
-                    b[(i * n2 + j) * self.D + l] = c[self.D - 1 - l]
-        return b.bytes
+        # 2. for j = 0; j < n2; j += 1
+        # 3. Cij = sum_{l=0}^{D-1} c_l * 2^l
+        # 4. for l = 0; l < D; L += 1
+        # 5. b[(i * n2 + j) * D + l] = c[D - 1 - l]
+        # i.e. each entry, taken mod 2^D, is written as a big-endian D-bit field in row-major order
+        mask = (1 << self.D) - 1
+        if self.backend == "numpy":
+            words = (C.ravel() & mask).astype('>u2')
+            if self.D == 16:
+                return words.tobytes()
+            bits = numpy.unpackbits(words.view(numpy.uint8)).reshape(-1, 16)[:, 16 - self.D:]
+            return numpy.packbits(bits).tobytes()
+        return FrodoKEM.__pack_words([x & mask for row in C for x in row], self.D)
     
     def unpack(self, b, n1, n2):
         """Unpack a bitstring (represented in Python as a bytes object) into a 
         matrix mod q (FrodoKEM specification, Algorithm 4)"""
-        C = [[0 for j in range(n2)] for i in range(n1)]
-        bbits = bitstring.Bits(b)
         # 1. for i = 0; i < n1; i += 1
-        for i in range(n1):
-            # 2. for j = 0; j < n2; j += 1
-            for j in range(n2):
-                # 3. Cij = sum_{l=0}^{D-1} b_{(i*n2+j)*D+l} * 2^{D-1-l}
-                for l in range(self.D):
-                    if bbits[(i * n2 + j) * self.D + l]: C[i][j] += 2 ** (self.D - 1 - l)
-        return C
+        # 2. for j = 0; j < n2; j += 1
+        # 3. Cij = sum_{l=0}^{D-1} b_{(i*n2+j)*D+l} * 2^{D-1-l}
+        # i.e. the inverse of pack, reading big-endian D-bit fields in row-major order
+        if self.backend == "numpy":
+            if self.D == 16:
+                return numpy.frombuffer(b, dtype = '>u2', count = n1 * n2).reshape(n1, n2).astype(numpy.uint16)
+            bits = numpy.unpackbits(numpy.frombuffer(b, dtype = numpy.uint8))[0 : n1 * n2 * self.D].reshape(n1 * n2, self.D)
+            bits = numpy.pad(bits, ((0, 0), (16 - self.D, 0)))
+            return numpy.packbits(bits, axis = 1).view('>u2').reshape(n1, n2).astype(numpy.uint16)
+        values = FrodoKEM.__unpack_words(b, n1 * n2, self.D)
+        return [values[i * n2 : (i + 1) * n2] for i in range(n1)]
 
     def sample(self, r):
         """Sample from the error distribution using noise r (a two-byte array 
@@ -390,52 +576,126 @@ class FrodoKEM(object):
 
     def sample_matrix(self, r, n1, n2):
         """Sample an n1 x n2 matrix from the error distribution using noise r 
-        (FrodoKEM specification, Algorithm 6)"""
-        E = [[None for j in range(n2)] for i in range(n1)]
+        (FrodoKEM specification, Algorithm 6)
+        
+        All n1 * n2 samples are computed in one pass over r, applying Algorithm 5 
+        table-wise: each magnitude is the number of T_chi entries its noise value 
+        exceeds, always compared against the whole table, and the sign is applied 
+        with a mask derived from the low bit rather than by branching."""
+        table = self.T_chi[:-1]
+        if self.backend == "numpy":
+            r = numpy.asarray(r[0 : n1 * n2], dtype = numpy.uint16)
+            # 1. t = sum_{i=1}^{len_x - 1} r_i * 2^{i-1}
+            t = r >> 1
+            # 2.-5. e = #{z : t > T_chi(z)}
+            e = numpy.zeros(n1 * n2, dtype = numpy.uint16)
+            for T in table:
+                e += t > T
+            # 6. e = (-1)^{r_0} * e, i.e. (e XOR -r_0) + r_0 in two's complement modulo 2^16
+            r0 = r & 1
+            e = (e ^ (numpy.uint16(0) - r0)) + r0
+            return e.reshape(n1, n2)
+        E = [None for i in range(n1)]
         # 1. for i = 0; i < n1; i += 1
         for i in range(n1):
+            E[i] = row = list(r[i * n2 : (i + 1) * n2])
             # 2. for j = 0; j < n2; j += 1
             for j in range(n2):
                 # 3. E[i][j] = Frodo.Sample(r^{i*n2+j}, T_chi)
-                E[i][j] = self.sample(r[i * n2 + j])
+                x = row[j]
+                t = x >> 1
+                e = 0
+                for T in table:
+                    e += t > T
+                r0 = x & 1
+                row[j] = (e ^ -r0) + r0
         return E
 
     def genAES128(self, seedA):
         """Generate matrix A using AES-128 (FrodoKEM specification, Algorithm 7)"""
-        A = [[None for j in range(self.n)] for i in range(self.n)]
+        return self.genAES128_rows(seedA, 0, self.n)
+
+    def genAES128_rows(self, seedA, start, stop):
+        """Generate rows start, ..., stop - 1 of matrix A using AES-128 (FrodoKEM 
+        specification, Algorithm 7, restricted to those values of i). All input 
+        blocks for the requested rows are encrypted in one AES-ECB call."""
+        nrows = stop - start
         # 1. for i = 0; i < n; i += 1
-        for i in range(self.n):
-            # 2. for j = 0; j < n; j += 8
-            for j in range(0, self.n, 8):
-                # 3. b = i || j || 0 || ... || 0 in {0,1}^128, where i and j are encoded as 16-bit integers in little-endian byte order
-                b = bytearray(16)
-                struct.pack_into('<H', b, 0, i)
-                struct.pack_into('<H', b, 2, j)
-                # 4. c = AES128(seedA, b)
-                c = FrodoKEM.__aes128_16bytesonly(seedA, b)
-                # 5. for k = 0; k < 8; k += 1
-                for k in range(8):
-                    # 6. A[i][j+k] = c[k] where c is treated as a sequence of 8 16-bit integers each in little-endian byte order
-                    A[i][j + k] = struct.unpack_from('<H', c, 2 * k)[0] % self.q
-        return A
+        # 2. for j = 0; j < n; j += 8
+        # 3. b = i || j || 0 || ... || 0 in {0,1}^128, where i and j are encoded as 16-bit integers in little-endian byte order
+        if self.backend == "numpy":
+            b = numpy.zeros((nrows, self.n // 8, 8), dtype = '<u2')
+            b[:, :, 0] = numpy.arange(start, stop).reshape(nrows, 1)
+            b[:, :, 1] = numpy.arange(0, self.n, 8).reshape(1, self.n // 8)
+            b = b.tobytes()
+        else:
+            b = b''.join(struct.pack('<HH12x', i, j) for i in range(start, stop) for j in range(0, self.n, 8))
+        # 4. c = AES128(seedA, b)
+        c = FrodoKEM.__aes128_ecb(seedA, b)
+        # 5. for k = 0; k < 8; k += 1
+        # 6. A[i][j+k] = c[k] where c is treated as a sequence of 8 16-bit integers each in little-endian byte order
+        if self.backend == "numpy":
+            return numpy.frombuffer(c, dtype = '<u2').reshape(nrows, self.n).astype(numpy.uint16) & (self.q - 1)
+        c = FrodoKEM.__uint16_le(c)
+        return [[x % self.q for x in c[i * self.n : (i + 1) * self.n]] for i in range(nrows)]
 
     def genSHAKE128(self, seedA):
         """Generate matrix A using SHAKE-128 (FrodoKEM specification, Algorithm 8)"""
-        A = [[None for j in range(self.n)] for i in range(self.n)]
+        return self.genSHAKE128_rows(seedA, 0, self.n)
+
+    def genSHAKE128_rows(self, seedA, start, stop):
+        """Generate rows start, ..., stop - 1 of matrix A using SHAKE-128 (FrodoKEM 
+        specification, Algorithm 8, restricted to those values of i). The SHAKE 
+        outputs of all requested rows are parsed in a single conversion."""
+        nrows = stop - start
+        c = []
         # 1. for i = 0; i < n; i += 1
-        for i in range(self.n):
+        for i in range(start, stop):
             # 2. b = i || seedA in {0,1}^{16 + len_seedA}, where i is encoded as a 16-bit integer in little-endian byte order
-            tmp = bytearray(2)
-            struct.pack_into('<H', tmp, 0, i)
-            b = tmp + seedA
+            b = struct.pack('<H', i) + seedA
             # 3. c_{i,0} || c_{i,1} || ... || c_{i,n-1} = SHAKE128(b, 16n) (length in bits) where each c_{i,j} is parsed as a 16-bit integer in little-endian byte order format
-            tmp = FrodoKEM.__shake128(b, int(16 * self.n / 8))
-            c_i = [struct.unpack_from('<H', tmp, 2 * j)[0] for j in range(self.n)]
-            # 4. for j = 0; j < n; j +=1
-            for j in range(self.n):
-                # 5. A[i][j] = c[i][j] mod q
-                A[i][j] = c_i[j] % self.q
-        return A
+            c.append(FrodoKEM.__shake128(b, 2 * self.n))
+        c = b''.join(c)
+        # 4. for j = 0; j < n; j +=1
+        # 5. A[i][j] = c[i][j] mod q
+        if self.backend == "numpy":
+            return numpy.frombuffer(c, dtype = '<u2').reshape(nrows, self.n).astype(numpy.uint16) & (self.q - 1)
+        c = FrodoKEM.__uint16_le(c)
+        return [[x % self.q for x in c[i * self.n : (i + 1) * self.n]] for i in range(nrows)]
+
+    def __gen_A(self, seedA):
+        """A = Frodo.Gen(seedA), served from the A-matrix cache if one is configured"""
+        if self.a_cache is None:
+            return self.gen(seedA)
+        return self.a_cache.get((self.variant, self.backend, bytes(seedA)), lambda: self.gen(seedA))
+
+    def __matrix_mul_A_right(self, seedA, S):
+        """Compute A S mod q for A = Frodo.Gen(seedA). With strip_rows set, A is 
+        generated a strip of rows at a time and each strip yields the matching rows 
+        of the result, so A is never held in memory as a whole."""
+        if self.a_cache is not None or self.strip_rows is None:
+            return self.__matrix_mul(self.__gen_A(seedA), S)
+        R = []
+        for start in range(0, self.n, self.strip_rows):
+            stop = min(start + self.strip_rows, self.n)
+            R.append(self.__matrix_mul(self.gen_rows(seedA, start, stop), S))
+        return self.__matrix_vstack(R)
+
+    def __matrix_mul_A_left(self, S, seedA, A = None):
+        """Compute S A mod q for A = Frodo.Gen(seedA), or for the given A if already 
+        generated. With strip_rows set, A is generated a strip of rows at a time and 
+        the product of each strip with the matching columns of S is accumulated into 
+        the result."""
+        if A is not None:
+            return self.__matrix_mul(S, A)
+        if self.a_cache is not None or self.strip_rows is None:
+            return self.__matrix_mul(S, self.__gen_A(seedA))
+        R = None
+        for start in range(0, self.n, self.strip_rows):
+            stop = min(start + self.strip_rows, self.n)
+            partial = self.__matrix_mul(self.__matrix_columns(S, start, stop), self.gen_rows(seedA, start, stop))
+            R = partial if R is None else self.__matrix_add(R, partial)
+        return R
 
     def kem_keygen(self):
         """Generate a public key / secret key pair (FrodoKEM specification, 
@@ -450,11 +710,10 @@ class FrodoKEM(object):
         seedA = self.shake(z, self.len_seedA_bytes)
         self.__print_intermediate_value("seedA", seedA)
         # 3. A = Frodo.Gen(seedA)
-        A = self.gen(seedA)
-        # self.__print_intermediate_value("A", A)
+        # (generated as part of the product A S in step 7)
         # 4. r = SHAKE(0x5F || seedSE, 2*n*nbar*len_chi) (length in bits), parsed as 2*n*nbar len_chi-bit integers in little-endian byte order
         rbytes = self.shake(bytes(b'\x5f') + seedSE, 2 * self.n * self.nbar * self.len_chi_bytes)
-        r = [struct.unpack_from('<H', rbytes, 2*i)[0] for i in range(2 * self.n * self.nbar)]
+        r = FrodoKEM.__uint16_le(rbytes)
         self.__print_intermediate_value("r", r)
         # 5. S^T = Frodo.SampleMatrix(r[0 .. n*nbar-1], nbar, n)
         Stransposed = self.sample_matrix(r[0 : self.n * self.nbar], self.nbar, self.n)
@@ -464,7 +723,7 @@ class FrodoKEM(object):
         E = self.sample_matrix(r[self.n * self.nbar : 2 * self.n * self.nbar], self.n, self.nbar)
         # self.__print_intermediate_value("E", E)
         # 7. B = A S + E
-        B = self.__matrix_add(self.__matrix_mul(A, S), E)
+        B = self.__matrix_add(self.__matrix_mul_A_right(seedA, S), E)
         self.__print_intermediate_value("B", B)
         # 8. b = Pack(B)
         b = self.pack(B)
@@ -475,28 +734,106 @@ class FrodoKEM(object):
         # 10. pk = seedA || b, sk = (s || seedA || b, S^T, pkh)
         pk = seedA + b
         assert len(pk) == self.len_pk_bytes
-        sk = bitstring.BitArray()
-        sk.append(s + seedA + b)
-        for i in range(self.nbar):
-            for j in range(self.n):
-                sk.append(bitstring.BitArray(intle = Stransposed[i][j], length = 16))
-        sk.append(pkh)
-        sk = sk.bytes
+        # S^T is stored as signed 16-bit integers in little-endian byte order
+        if self.backend == "numpy":
+            Sbytes = Stransposed.astype('<u2').tobytes()
+        else:
+            Sbytes = array.array('h', [x for row in Stransposed for x in row])
+            if sys.byteorder == 'big': Sbytes.byteswap()
+            Sbytes = Sbytes.tobytes()
+        sk = s + seedA + b + Sbytes + pkh
         assert len(sk) == self.len_sk_bytes
         return (pk, sk)
 
-    def kem_encaps(self, pk):
-        """Encapsulate against a public key to create a ciphertext and shared secret 
-        (FrodoKEM specification, Algorithm 13)"""
+    def __prepared_A(self, seedA):
+        """A for a prepared key: kept only without an A-matrix cache, whose budget and 
+        eviction must bound every A held (with a cache, each use is a cache lookup), and 
+        unless A is to be generated in strips on every use"""
+        if self.a_cache is not None or self.strip_rows is not None:
+            return None
+        return self.__gen_A(seedA)
+
+    def prepare_public_key(self, pk):
+        """Parse a public key and precompute the key-dependent values used by 
+        kem_encaps, returning a PreparedPublicKey that kem_encaps accepts in place 
+        of pk"""
         # Parse pk = seedA || b
         assert len(pk) == self.len_seedA_bytes + self.D * self.n * self.nbar / 8, "Incorrect public key length"
         seedA = pk[0 : self.len_seedA_bytes]
         b = pk[self.len_seedA_bytes:]
+        # pkh = SHAKE(pk, len_pkh)
+        pkh = self.shake(pk, self.len_pkh_bytes)
+        # B = Frodo.Unpack(b, n, nbar)
+        B = self.unpack(b, self.n, self.nbar)
+        return PreparedPublicKey(self.variant, self.backend, pk, seedA, b, pkh, B, self.__prepared_A(seedA))
+
+    def prepare_secret_key(self, sk):
+        """Parse a secret key and precompute the key-dependent values used by 
+        kem_decaps, returning a PreparedSecretKey that kem_decaps accepts in place 
+        of sk"""
+        # Parse sk = (s || seedA || b, S^T, pkh)
+        assert len(sk) == self.len_sk_bytes
+        offset = 0; length = self.len_s_bytes
+        s = sk[offset:offset+length]
+        offset += length; length = self.len_seedA_bytes
+        seedA = sk[offset:offset+length]
+        offset += length; length = int(self.D * self.n * self.nbar / 8)
+        b = sk[offset:offset+length]
+        offset += length; length = int(self.n * self.nbar * 16 / 8)
+        Sbytes = memoryview(sk)[offset:offset+length]
+        if self.backend == "numpy":
+            Stransposed = numpy.frombuffer(Sbytes, dtype = '<u2').reshape(self.nbar, self.n).astype(numpy.uint16)
+        else:
+            # S^T is stored as signed 16-bit integers in little-endian byte order
+            if sys.byteorder == 'little':
+                Svalues = Sbytes.cast('h')
+            else:
+                Svalues = array.array('h', Sbytes)
+                Svalues.byteswap()
+            Stransposed = [Svalues[i * self.n : (i + 1) * self.n].tolist() for i in range(self.nbar)]
+        S = self.__matrix_transpose(Stransposed)
+        offset += length; length = self.len_pkh_bytes
+        pkh = sk[offset:offset+length]
+        # B = Frodo.Unpack(b, n, nbar)
+        B = self.unpack(b, self.n, self.nbar)
+        return PreparedSecretKey(self.variant, self.backend, sk, s, seedA, b, Stransposed, S, pkh, B, self.__prepared_A(seedA))
+
+    def kem_encaps(self, pk):
+        """Encapsulate against a public key to create a ciphertext and shared secret 
+        (FrodoKEM specification, Algorithm 13)
+        
+        pk may be the public key bytes or a PreparedPublicKey from prepare_public_key."""
+        if not isinstance(pk, PreparedPublicKey):
+            pk = self.prepare_public_key(pk)
+        (mu, k, r, Sprime, Eprime) = self.__encaps_sample(pk)
+        # 7. A = Frodo.Gen(seedA)
+        # (generated as part of the product S' A in step 8)
+        SprimeA = self.__matrix_mul_A_left(Sprime, pk.seedA, pk.A)
+        return self.__encaps_finish(pk, mu, k, r, Sprime, Eprime, SprimeA)
+
+    def kem_encaps_many(self, pk, count):
+        """Encapsulate count times against the same public key, returning a list of 
+        (ciphertext, shared secret) pairs identical to those of count consecutive 
+        kem_encaps calls. The S' matrices of all calls are stacked into one 
+        (count * mbar) x n matrix so that S' A is computed in a single product."""
+        if not isinstance(pk, PreparedPublicKey):
+            pk = self.prepare_public_key(pk)
+        if count == 0:
+            return []
+        samples = [self.__encaps_sample(pk) for c in range(count)]
+        SprimeA = self.__matrix_mul_A_left(self.__matrix_vstack([Sprime for (mu, k, r, Sprime, Eprime) in samples]), pk.seedA, pk.A)
+        return [self.__encaps_finish(pk, mu, k, r, Sprime, Eprime, SprimeA[c * self.mbar : (c + 1) * self.mbar]) 
+                for (c, (mu, k, r, Sprime, Eprime)) in enumerate(samples)]
+
+    def __encaps_sample(self, pk):
+        """Steps 1-6 of kem_encaps: everything before the product S' A"""
+        # Parse pk = seedA || b
+        assert pk.variant == self.variant and pk.backend == self.backend, "Public key prepared for a different instance"
         # 1. Choose a uniformly random key mu in {0,1}^len_mu (length in bits)
         mu = self.randombytes(self.len_mu_bytes)
         self.__print_intermediate_value("mu", mu)
         # 2. pkh = SHAKE(pk, len_pkh)
-        pkh = self.shake(pk, self.len_pkh_bytes)
+        pkh = pk.pkh
         self.__print_intermediate_value("pkh", pkh)
         # 3. seedSE || k = SHAKE(pkh || mu, len_seedSE + len_k) (length in bits)
         seedSE_k = self.shake(pkh + mu, self.len_seedSE_bytes + self.len_k_bytes)
@@ -506,7 +843,7 @@ class FrodoKEM(object):
         self.__print_intermediate_value("k", k)
         # 4. r = SHAKE(0x96 || seedSE, 2*mbar*n + mbar*nbar*len_chi) (length in bits)
         rbytes = self.shake(bytes(b'\x96') + seedSE, (2 * self.mbar * self.n + self.mbar * self.mbar) * self.len_chi_bytes)
-        r = [struct.unpack_from('<H', rbytes, 2*i)[0] for i in range(2 * self.mbar * self.n + self.mbar * self.nbar)]
+        r = FrodoKEM.__uint16_le(rbytes)
         self.__print_intermediate_value("r", r)
         # 5. S' = Frodo.SampleMatrix(r[0 .. mbar*n-1], mbar, n)
         Sprime = self.sample_matrix(r[0 : self.mbar * self.n], self.mbar, self.n)
@@ -514,10 +851,12 @@ class FrodoKEM(object):
         # 6. E' = Frodo.SampleMatrix(r[mbar*n .. 2*mbar*n-1], mbar, n)
         Eprime = self.sample_matrix(r[self.mbar * self.n : 2 * self.mbar * self.n], self.mbar, self.n)
         self.__print_intermediate_value("E'", Eprime)
-        # 7. A = Frodo.Gen(seedA)
-        A = self.gen(seedA)
+        return (mu, k, r, Sprime, Eprime)
+
+    def __encaps_finish(self, pk, mu, k, r, Sprime, Eprime, SprimeA):
+        """Steps 8-15 of kem_encaps, given the product S' A"""
         # 8. B' = S' A + E'
-        Bprime = self.__matrix_add(self.__matrix_mul(Sprime, A), Eprime)
+        Bprime = self.__matrix_add(SprimeA, Eprime)
         self.__print_intermediate_value("B'", Bprime)
         # 9. c1 = Frodo.Pack(B')
         c1 = self.pack(Bprime)
@@ -526,7 +865,7 @@ class FrodoKEM(object):
         Eprimeprime = self.sample_matrix(r[2 * self.mbar * self.n : 2 * self.mbar * self.n + self.mbar * self.nbar], self.mbar, self.nbar)
         self.__print_intermediate_value("E''", Eprimeprime)
         # 11. B = Frodo.Unpack(b, n, nbar)
-        B = self.unpack(b, self.n, self.nbar)
+        B = pk.B
         self.__print_intermediate_value("B", B)
         # 12. V = S' B + E''
         V = self.__matrix_add(self.__matrix_mul(Sprime, B), Eprimeprime)
@@ -547,7 +886,34 @@ class FrodoKEM(object):
 
     def kem_decaps(self, sk, ct):
         """Decapsulate a ciphertext using a secret key to obtain a shared secret 
-        (FrodoKEM specification, Algorithm 14)"""
+        (FrodoKEM specification, Algorithm 14)
+        
+        sk may be the secret key bytes or a PreparedSecretKey from prepare_secret_key."""
+        if not isinstance(sk, PreparedSecretKey):
+            sk = self.prepare_secret_key(sk)
+        state = self.__decaps_sample(sk, ct)
+        Sprime = state[-1]
+        # 10. A = Frodo.Gen(seedA)
+        # (generated as part of the product S' A in step 11)
+        SprimeA = self.__matrix_mul_A_left(Sprime, sk.seedA, sk.A)
+        return self.__decaps_finish(sk, state, SprimeA)
+
+    def kem_decaps_many(self, sk, cts):
+        """Decapsulate a list of ciphertexts with the same secret key, returning the 
+        list of shared secrets that kem_decaps would return for each. The S' matrices 
+        of all ciphertexts are stacked into one (len(cts) * mbar) x n matrix so that 
+        S' A is computed in a single product."""
+        if not isinstance(sk, PreparedSecretKey):
+            sk = self.prepare_secret_key(sk)
+        if len(cts) == 0:
+            return []
+        states = [self.__decaps_sample(sk, ct) for ct in cts]
+        SprimeA = self.__matrix_mul_A_left(self.__matrix_vstack([state[-1] for state in states]), sk.seedA, sk.A)
+        return [self.__decaps_finish(sk, state, SprimeA[c * self.mbar : (c + 1) * self.mbar]) 
+                for (c, state) in enumerate(states)]
+
+    def __decaps_sample(self, sk, ct):
+        """Parsing and steps 1-9 of kem_decaps: everything before the product S' A"""
         # Parse ct = c1 || c2
         assert len(ct) == self.len_ct_bytes, "Incorrect ciphertext length"
         offset = 0; length = int(self.mbar * self.n * self.D / 8)
@@ -557,26 +923,13 @@ class FrodoKEM(object):
         c2 = ct[offset:offset+length]
         self.__print_intermediate_value("c2", c2)
         # Parse sk = (s || seedA || b, S^T, pkh)
-        assert len(sk) == self.len_sk_bytes
-        offset = 0; length = self.len_s_bytes
-        s = sk[offset:offset+length]
-        self.__print_intermediate_value("s", s)
-        offset += length; length = self.len_seedA_bytes
-        seedA = sk[offset:offset+length]
-        self.__print_intermediate_value("seedA", seedA)
-        offset += length; length = int(self.D * self.n * self.nbar / 8)
-        b = sk[offset:offset+length]
-        self.__print_intermediate_value("b", b)
-        offset += length; length = int(self.n * self.nbar * 16 / 8)
-        Sbytes = bitstring.ConstBitStream(sk[offset:offset+length])
-        Stransposed = [[0 for j in range(self.n)] for i in range(self.nbar)]
-        for i in range(self.nbar):
-            for j in range(self.n):
-                Stransposed[i][j] = Sbytes.read('intle:16')
-        self.__print_intermediate_value("S^T", Stransposed)
-        S = self.__matrix_transpose(Stransposed)
-        offset += length; length = self.len_pkh_bytes
-        pkh = sk[offset:offset+length]
+        assert sk.variant == self.variant and sk.backend == self.backend, "Secret key prepared for a different instance"
+        self.__print_intermediate_value("s", sk.s)
+        self.__print_intermediate_value("seedA", sk.seedA)
+        self.__print_intermediate_value("b", sk.b)
+        self.__print_intermediate_value("S^T", sk.Stransposed)
+        S = sk.S
+        pkh = sk.pkh
         self.__print_intermediate_value("pkh", pkh)
         # 1. B' = Frodo.Unpack(c1, mbar, n)
         Bprime = self.unpack(c1, self.mbar, self.n)
@@ -602,7 +955,7 @@ class FrodoKEM(object):
         self.__print_intermediate_value("k'", kprime)
         # 7. r = SHAKE(0x96 || seedSE', 2*mbar*n + mbar*nbar*len_chi) (length in bits)
         rbytes = self.shake(bytes(b'\x96') + seedSEprime, (2 * self.mbar * self.n + self.mbar * self.mbar) * self.len_chi_bytes)
-        r = [struct.unpack_from('<H', rbytes, 2*i)[0] for i in range(2 * self.mbar * self.n + self.mbar * self.nbar)]
+        r = FrodoKEM.__uint16_le(rbytes)
         self.__print_intermediate_value("r", r)
         # 8. S' = Frodo.SampleMatrix(r[0 .. mbar*n-1], mbar, n)
         Sprime = self.sample_matrix(r[0 : self.mbar * self.n], self.mbar, self.n)
@@ -610,16 +963,19 @@ class FrodoKEM(object):
         # 9. E' = Frodo.SampleMatrix(r[mbar*n .. 2*mbar*n-1], mbar, n)
         Eprime = self.sample_matrix(r[self.mbar * self.n : 2 * self.mbar * self.n], self.mbar, self.n)
         self.__print_intermediate_value("E'", Eprime)
-        # 10. A = Frodo.Gen(seedA)
-        A = self.gen(seedA)
+        return (c1, c2, Bprime, C, muprime, kprime, r, Eprime, Sprime)
+
+    def __decaps_finish(self, sk, state, SprimeA):
+        """Steps 11-17 of kem_decaps, given the product S' A"""
+        (c1, c2, Bprime, C, muprime, kprime, r, Eprime, Sprime) = state
         # 11. B'' = S' A + E'
-        Bprimeprime = self.__matrix_add(self.__matrix_mul(Sprime, A), Eprime)
+        Bprimeprime = self.__matrix_add(SprimeA, Eprime)
         self.__print_intermediate_value("B''", Bprimeprime)
         # 12. E'' = Frodo.SampleMatrix(r[2*mbar*n .. 2*mbar*n + mbar*nbar-1], mbar, n)
         Eprimeprime = self.sample_matrix(r[2 * self.mbar * self.n : 2 * self.mbar * self.n + self.mbar * self.nbar], self.mbar, self.nbar)
         self.__print_intermediate_value("E''", Eprimeprime)
         # 13. B = Frodo.Unpack(b, n, nbar)
-        B = self.unpack(b, self.n, self.nbar)
+        B = sk.B
         self.__print_intermediate_value("B", B)
         # 14. V = S' B + E''
         V = self.__matrix_add(self.__matrix_mul(Sprime, B), Eprimeprime)
@@ -631,9 +987,12 @@ class FrodoKEM(object):
         # Needs to avoid branching on secret data as per:
         #     Qian Guo, Thomas Johansson, Alexander Nilsson. A key-recovery timing attack on post-quantum 
         #     primitives using the Fujisaki-Okamoto transformation and its application on FrodoKEM. In CRYPTO 2020.
-        use_kprime = self.__ctverify(Bprime + C, Bprimeprime + Cprime)
-        kbar = self.__ctselect(kprime, s, use_kprime)
+        if self.backend == "numpy":
+            use_kprime = FrodoKEM.__ctverify_array(numpy.hstack((Bprime, C)), numpy.hstack((Bprimeprime, Cprime)))
+        else:
+            use_kprime = self.__ctverify(Bprime + C, Bprimeprime + Cprime)
+        kbar = self.__ctselect(kprime, sk.s, use_kprime)
         # 17. ss = SHAKE(c1 || c2 || kbar, len_ss) (length in bits)
         ss = self.shake(c1 + c2 + kbar, self.len_ss_bytes)
         assert len(ss) == self.len_ss_bytes
-        return ss
\ No newline at end of file
+        return ss
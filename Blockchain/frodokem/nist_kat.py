@@ -3,6 +3,7 @@
 # Created by Douglas Stebila
 
 import frodokem
+import sys
 
 class NISTKAT(object):
     
@@ -60,10 +61,12 @@ class NISTKAT(object):
             return r
 
 if __name__ == "__main__":
-    # Run KATs for all supported FrodoKEM variants
-    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-640-AES'))
-    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-640-SHAKE'))
-    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-976-AES'))
-    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-976-SHAKE'))
-    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-1344-AES'))
-    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-1344-SHAKE'))
\ No newline at end of file
+    # Run KATs for all supported FrodoKEM variants, optionally on a non-default 
+    # backend, e.g. "python nist_kat.py numpy"; the output must not depend on it
+    backend = sys.argv[1] if len(sys.argv) > 1 else "python"
+    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-640-AES', backend))
+    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-640-SHAKE', backend))
+    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-976-AES', backend))
+    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-976-SHAKE', backend))
+    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-1344-AES', backend))
+    NISTKAT.run(frodokem.FrodoKEM('FrodoKEM-1344-SHAKE', backend))
\ No newline at end of file
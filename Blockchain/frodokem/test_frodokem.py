@@ -0,0 +1,61 @@
+import hashlib
+
+import pytest
+
+import frodokem
+
+BACKENDS = ['python', pytest.param('numpy', marks=pytest.mark.skipif(frodokem.numpy is None, reason='numpy is not installed'))]
+
+
+# deterministic randombytes: consecutive slices of a SHAKE-256 stream of seed
+class SeededRNG(object):
+    def __init__(self, seed):
+        self.stream = hashlib.shake_256(seed).digest(4096)
+        self.offset = 0
+
+    def randombytes(self, n):
+        r = self.stream[self.offset:self.offset + n]
+        self.offset += n
+        return r
+
+
+def seeded_kem(variant, backend, seed):
+    kem = frodokem.FrodoKEM(variant, backend)
+    kem.randombytes = SeededRNG(seed).randombytes
+    return kem
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('variant', ['FrodoKEM-640-AES', 'FrodoKEM-640-SHAKE'])
+def test_batch_apis_match_single_calls(variant, backend):
+    # both instances draw the same randomness in the same order
+    single = seeded_kem(variant, backend, b'batch')
+    batch = seeded_kem(variant, backend, b'batch')
+    (pk, sk) = single.kem_keygen()
+    assert batch.kem_keygen() == (pk, sk)
+
+    expected = [single.kem_encaps(pk) for i in range(3)]
+    assert batch.kem_encaps_many(pk, 3) == expected
+
+    # a tampered ciphertext takes the implicit rejection path
+    cts = [ct for (ct, ss) in expected]
+    cts.append(bytes([cts[0][0] ^ 1]) + cts[0][1:])
+    shared_secrets = [single.kem_decaps(sk, ct) for ct in cts]
+    assert shared_secrets[:3] == [ss for (ct, ss) in expected]
+    assert shared_secrets[3] != expected[0][1]
+    assert batch.kem_decaps_many(sk, cts) == shared_secrets
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_batch_apis_accept_prepared_keys(backend):
+    single = seeded_kem('FrodoKEM-640-SHAKE', backend, b'prepared')
+    batch = seeded_kem('FrodoKEM-640-SHAKE', backend, b'prepared')
+    (pk, sk) = single.kem_keygen()
+    batch.kem_keygen()
+
+    expected = [single.kem_encaps(pk) for i in range(2)]
+    assert batch.kem_encaps_many(batch.prepare_public_key(pk), 2) == expected
+    cts = [ct for (ct, ss) in expected]
+    assert batch.kem_decaps_many(batch.prepare_secret_key(sk), cts) == [ss for (ct, ss) in expected]
+    assert batch.kem_encaps_many(pk, 0) == []
+    assert batch.kem_decaps_many(sk, []) == []
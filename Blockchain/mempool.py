@@ -0,0 +1,178 @@
+"""
+
+Blockchain Mempool:
+
+    Pending transaction pool shared by the blockchain scripts
+
+    Transactions are indexed by hash for O(1) lookup and duplicate detection
+    and queued per sender in nonce order. A heap holds the lowest-nonce
+    transaction of each sender by priority, so assembling a block of k
+    transactions costs O(k log n); a second heap finds the lowest-priority
+    transaction to evict when the pool is over its count or byte cap.
+    Stale heap entries are skipped when popped and compacted away once the
+    heaps hold several times more entries than the pool.
+
+"""
+# import libraries
+import heapq
+import itertools
+import threading
+
+
+class _Entry:
+    __slots__ = ('tx_hash', 'item', 'sender', 'nonce', 'size', 'priority', 'seq')
+
+    def __init__(self, tx_hash, item, sender, nonce, size, priority, seq):
+        self.tx_hash = tx_hash
+        self.item = item
+        self.sender = sender
+        self.nonce = nonce
+        self.size = size
+        self.priority = priority
+        self.seq = seq
+
+
+class Mempool:
+    def __init__(self, max_count=100000, max_bytes=64 * 1024 * 1024):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = {}
+        # sender -> (heap of pending nonces, {nonce: entry})
+        self._senders = {}
+        # (-priority, seq, hash) of each sender's lowest pending nonce
+        self._ready = []
+        # (priority, -seq, hash) of every entry
+        self._lowest = []
+        self._seq = itertools.count()
+        self._next_nonce = {}
+        self._lock = threading.Lock()
+
+    def _head(self, sender):
+        queue = self._senders.get(sender)
+        if queue is None:
+            return None
+        (nonces, by_nonce) = queue
+        while nonces and nonces[0] not in by_nonce:
+            heapq.heappop(nonces)
+        return by_nonce[nonces[0]] if nonces else None
+
+    def _push_ready(self, entry):
+        heapq.heappush(self._ready, (-entry.priority, entry.seq, entry.tx_hash))
+
+    def _live(self, seq, tx_hash):
+        entry = self._entries.get(tx_hash)
+        return entry if entry is not None and entry.seq == seq else None
+
+    def _remove(self, entry):
+        del self._entries[entry.tx_hash]
+        self.bytes -= entry.size
+        (nonces, by_nonce) = self._senders[entry.sender]
+        del by_nonce[entry.nonce]
+        if not by_nonce:
+            del self._senders[entry.sender]
+            self._next_nonce.pop(entry.sender, None)
+            return
+        head = self._head(entry.sender)
+        if head.nonce > entry.nonce:
+            self._push_ready(head)
+
+    def _compact(self):
+        if len(self._ready) + len(self._lowest) > 4 * len(self._entries) + 64:
+            self._ready = [(-e.priority, e.seq, e.tx_hash) for e in map(self._head, self._senders)]
+            self._lowest = [(e.priority, -e.seq, e.tx_hash) for e in self._entries.values()]
+            heapq.heapify(self._ready)
+            heapq.heapify(self._lowest)
+
+    # add a transaction under its hash; nonce orders the transactions of one
+    # sender and defaults to their arrival order. A transaction reusing a
+    # sender's nonce replaces the pending one only with a higher priority.
+    # Returns False for a duplicate, a lower-priority replacement, or a
+    # transaction evicted straight away because the pool is full of better ones
+    def add(self, tx_hash, item, sender, size, priority=0, nonce=None):
+        with self._lock:
+            if tx_hash in self._entries:
+                return False
+            if nonce is None:
+                nonce = self._next_nonce.get(sender, 0)
+            next_nonce = max(self._next_nonce.get(sender, 0), nonce + 1)
+            queue = self._senders.setdefault(sender, ([], {}))
+            replaced = queue[1].get(nonce)
+            if replaced is not None:
+                if replaced.priority >= priority:
+                    return False
+                self._remove(replaced)
+                queue = self._senders.setdefault(sender, ([], {}))
+            # set after the replacement, whose removal may have reset it
+            self._next_nonce[sender] = next_nonce
+            entry = _Entry(tx_hash, item, sender, nonce, size, priority, next(self._seq))
+            self._entries[tx_hash] = entry
+            self.bytes += size
+            heapq.heappush(queue[0], nonce)
+            queue[1][nonce] = entry
+            heapq.heappush(self._lowest, (priority, -entry.seq, tx_hash))
+            if self._head(sender) is entry:
+                self._push_ready(entry)
+            self._evict()
+            self._compact()
+            return tx_hash in self._entries
+
+    # drop lowest-priority transactions, with the later nonces of their
+    # senders that depend on them, until the pool is within its caps
+    def _evict(self):
+        while (len(self._entries) > self.max_count or self.bytes > self.max_bytes) and self._lowest:
+            (priority, negative_seq, tx_hash) = heapq.heappop(self._lowest)
+            entry = self._live(-negative_seq, tx_hash)
+            if entry is None:
+                continue
+            by_nonce = self._senders[entry.sender][1]
+            for dependent in [e for e in by_nonce.values() if e.nonce >= entry.nonce]:
+                self._remove(dependent)
+
+    # take the highest-priority transactions that fit in max_bytes (and
+    # max_count, if given) out of the pool, each sender's in nonce order
+    def select_for_block(self, max_bytes, max_count=None):
+        with self._lock:
+            selected = []
+            skipped = []
+            used = 0
+            while self._ready and (max_count is None or len(selected) < max_count):
+                (negative_priority, seq, tx_hash) = heapq.heappop(self._ready)
+                entry = self._live(seq, tx_hash)
+                if entry is None or self._head(entry.sender) is not entry:
+                    continue
+                if used + entry.size > max_bytes:
+                    # this sender's later nonces have to wait for it
+                    skipped.append((negative_priority, seq, tx_hash))
+                    continue
+                used += entry.size
+                selected.append(entry.item)
+                self._remove(entry)
+            for item in skipped:
+                heapq.heappush(self._ready, item)
+            self._compact()
+            return selected
+
+    # remove a transaction, e.g. once a peer's block has confirmed it
+    def remove(self, tx_hash):
+        with self._lock:
+            entry = self._entries.get(tx_hash)
+            if entry is None:
+                return False
+            self._remove(entry)
+            self._compact()
+            return True
+
+    def get(self, tx_hash):
+        with self._lock:
+            entry = self._entries.get(tx_hash)
+            return entry.item if entry is not None else None
+
+    def __contains__(self, tx_hash):
+        with self._lock:
+            return tx_hash in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
@@ -0,0 +1,78 @@
+"""
+
+Blockchain Merkle Trees:
+
+    Merkle trees over the transaction hashes of a block, shared by the
+    blockchain scripts
+
+    Leaves and interior nodes are hashed with distinct prefixes, so a leaf
+    can never be passed off as an interior node. A node without a sibling at
+    the end of an odd-length level is carried up unchanged rather than
+    paired with a copy of itself, so no two transaction lists share a root.
+    An inclusion proof is the list of sibling hashes on the path from a leaf
+    to the root and is checked with O(log n) hashes.
+
+"""
+# import libraries
+import hashlib
+
+_LEAF = b'\x00'
+_NODE = b'\x01'
+
+# root of the empty tree
+EMPTY_ROOT = hashlib.sha256(b'').digest()
+
+
+def hash_leaf(data):
+    return hashlib.sha256(_LEAF + data).digest()
+
+def hash_node(left, right):
+    return hashlib.sha256(_NODE + left + right).digest()
+
+
+class MerkleTree:
+    # leaves are the raw transaction hashes, in block order
+    def __init__(self, leaves):
+        level = [hash_leaf(leaf) for leaf in leaves]
+        self.levels = [level]
+        while len(level) > 1:
+            level = [hash_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        return self.levels[-1][0] if self.levels[0] else EMPTY_ROOT
+
+    # the (sibling hash, sibling is on the left) pairs from leaf index up to
+    # the root; levels where the node has no sibling are skipped
+    def proof(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("leaf index out of range")
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append((level[sibling], sibling < index))
+            index //= 2
+        return path
+
+
+def merkle_root(leaves):
+    return MerkleTree(leaves).root
+
+# whether proof shows that the raw transaction hash leaf is in the tree with
+# the given root
+def verify_proof(leaf, proof, root):
+    node = hash_leaf(leaf)
+    for (sibling, sibling_is_left) in proof:
+        node = hash_node(sibling, node) if sibling_is_left else hash_node(node, sibling)
+    return node == root
+
+# number of leaves whose inclusion proofs from tree verify against root, as
+# a light client holding only the root (e.g. from a block header) checks them
+def count_proven(tree, leaves, root):
+    return sum(verify_proof(leaf, tree.proof(index), root) for (index, leaf) in enumerate(leaves))
@@ -0,0 +1,180 @@
+"""
+
+Blockchain Mining:
+
+    Multi-process proof-of-work miner shared by the blockchain scripts
+
+    The nonce space is cut into fixed-size chunks which are dealt out
+    round-robin to worker processes; the first worker to find a nonce
+    satisfying the difficulty stops all the others.
+
+"""
+# import libraries
+import os
+import time
+import hashlib
+import timeit
+import multiprocessing
+
+
+# split a hex digest prefix into the raw digest bytes it fixes and, for an
+# odd-length prefix, the value of the following high nibble (else None)
+def hex_prefix_to_bytes(prefix):
+    if len(prefix) % 2 == 0:
+        return (bytes.fromhex(prefix), None)
+    return (bytes.fromhex(prefix[:-1]), int(prefix[-1], 16))
+
+# proof-of-work rule of the blockchain scripts: the hex SHA-256 digest of
+# message + str(nonce) must start with prefix.
+# The message is absorbed once into a hash object that is copied per nonce,
+# and the prefix is compared against the raw digest bytes.
+def scan_prefix(work, start, stop):
+    (message, prefix) = work
+    (target, nibble) = hex_prefix_to_bytes(prefix)
+    length = len(target)
+    copy = hashlib.sha256(message.encode('ascii')).copy
+    for nonce in range(start, stop):
+        h = copy()
+        h.update(b'%d' % nonce)
+        digest = h.digest()
+        if digest[:length] == target and (nibble is None or digest[length] >> 4 == nibble):
+            return (nonce, digest.hex(), nonce - start + 1)
+    return (None, None, stop - start)
+
+# proof-of-work rule of the old Flask node: the hex SHA-256 digest of
+# str(nonce**2 - previous_proof**2) must start with '0000', i.e. the raw
+# digest must start with two zero bytes. The hashed string has no constant
+# prefix to precompute, but the square is updated incrementally.
+def scan_square_difference(work, start, stop):
+    sha256 = hashlib.sha256
+    previous_square = work**2
+    square = start**2
+    for nonce in range(start, stop):
+        digest = sha256(b'%d' % (square - previous_square)).digest()
+        if digest[:2] == b'\0\0':
+            return (nonce, digest.hex(), nonce - start + 1)
+        square += 2 * nonce + 1
+    return (None, None, stop - start)
+
+
+# worker process: scans chunks first_chunk, first_chunk + step, ... until a
+# nonce is found, the stop event is set or the limit is reached, then reports
+# exactly one (nonce, digest, hashes) tuple
+def _mine_worker(scan, work, start, limit, chunk_size, first_chunk, step, stop_event, results):
+    hashes = 0
+    chunk = first_chunk
+    while not stop_event.is_set():
+        chunk_start = start + chunk * chunk_size
+        chunk_stop = chunk_start + chunk_size
+        if limit is not None:
+            chunk_stop = min(chunk_stop, limit)
+            if chunk_start >= chunk_stop:
+                break
+        (nonce, digest, count) = scan(work, chunk_start, chunk_stop)
+        hashes += count
+        if nonce is not None:
+            stop_event.set()
+            results.put((nonce, digest, hashes))
+            return
+        chunk += step
+    results.put((None, None, hashes))
+
+
+class MiningResult:
+    def __init__(self, nonce, digest, hashes, elapsed):
+        # nonce and digest are None if mining was cancelled or the range exhausted
+        self.nonce = nonce
+        self.digest = digest
+        self.hashes = hashes
+        self.elapsed = elapsed
+
+    @property
+    def hash_rate(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.hashes / self.elapsed
+
+
+class Miner:
+    def __init__(self, workers=None, chunk_size=10000):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._context = multiprocessing.get_context()
+        self._stop_event = None
+
+    # search nonces start, start + 1, ... (below limit, if given) with the
+    # module-level function scan(work, start, stop) -> (nonce, digest, hashes)
+    def mine(self, scan, work, start=0, limit=None):
+        stop_event = self._context.Event()
+        results = self._context.Queue()
+        self._stop_event = stop_event
+        workers = [self._context.Process(target=_mine_worker,
+                                         args=(scan, work, start, limit, self.chunk_size,
+                                               w, self.workers, stop_event, results),
+                                         daemon=True)
+                   for w in range(self.workers)]
+        time_start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        found = (None, None)
+        hashes = 0
+        for worker in workers:
+            (nonce, digest, count) = results.get()
+            hashes += count
+            if nonce is not None and found[0] is None:
+                found = (nonce, digest)
+        for worker in workers:
+            worker.join()
+        self._stop_event = None
+        return MiningResult(found[0], found[1], hashes, time.perf_counter() - time_start)
+
+    # stop the search in progress, e.g. when a new block arrives from a peer;
+    # safe to call from another thread
+    def cancel(self):
+        stop_event = self._stop_event
+        if stop_event is not None:
+            stop_event.set()
+
+
+# the scans as written before midstate hashing, kept as the benchmark baseline
+def _scan_prefix_hex(work, start, stop):
+    (message, prefix) = work
+    for nonce in range(start, stop):
+        digest = hashlib.sha256((message + str(nonce)).encode('ascii')).hexdigest()
+        if digest.startswith(prefix):
+            return (nonce, digest, nonce - start + 1)
+    return (None, None, stop - start)
+
+def _scan_square_difference_hex(work, start, stop):
+    previous_proof = work
+    for nonce in range(start, stop):
+        digest = hashlib.sha256(str(nonce**2 - previous_proof**2).encode()).hexdigest()
+        if digest[:4] == '0000':
+            return (nonce, digest, nonce - start + 1)
+    return (None, None, stop - start)
+
+# scan nonces 0 .. count - 1, continuing past any solutions found
+def _scan_all(scan, work, count):
+    start = 0
+    while start < count:
+        (nonce, digest, hashes) = scan(work, start, count)
+        start += hashes
+
+# single-core hash rate of scan, from the fastest of repeat runs
+def _hash_rate(scan, work, count, repeat=5):
+    return count / min(timeit.repeat(lambda: _scan_all(scan, work, count), number=1, repeat=repeat))
+
+# micro-benchmark of the hashes/s per core of each scan before and after
+# midstate hashing and raw digest comparison
+def benchmark(count=300000):
+    message = str(hash(object()))
+    cases = [('scan_prefix', _scan_prefix_hex, scan_prefix, (message, '11')),
+             ('scan_square_difference', _scan_square_difference_hex, scan_square_difference, 533)]
+    for (name, before, after, work) in cases:
+        rate_before = _hash_rate(before, work, count)
+        rate_after = _hash_rate(after, work, count)
+        print(name + ": before " + str(int(rate_before)) + " hashes/s, after "
+              + str(int(rate_after)) + " hashes/s per core")
+
+if __name__ == '__main__':
+    benchmark()
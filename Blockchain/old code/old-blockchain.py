@@ -1,11 +1,13 @@
 # Module 2 - Create a Cryptocurrency
 
 # To be installed:
-# Flask==0.12.2: pip install Flask==0.12.2
+# aiohttp: pip install aiohttp
 # Postman HTTP Client: https://www.getpostman.com/
-# requests==2.18.4: pip install requests==2.18.4
 
 # Importing the libraries
+import aiohttp
+from aiohttp import web
+import asyncio
 import binascii
 import collections
 from Crypto.Hash import SHA256
@@ -14,66 +16,172 @@ import Crypto.Random.random
 from Crypto.Signature import pkcs1_15
 import datetime
 import datetime
-from flask import Flask, jsonify, request
 import hashlib
 import json
-import requests
+import os
+import sys
 from typing import Collection
 from uuid import uuid4
 from urllib.parse import urlparse
 
+# the shared modules of the blockchain scripts live in the parent directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import mining
+import chainstore
+import mempool
+import merkle
+
 # Part 1 - Building a Blockchain
 
+# size limit of the transactions taken from the mempool into one block
+MAX_BLOCK_BYTES = 1024 * 1024
+
+# seconds allowed for fetching one peer's chain
+PEER_TIMEOUT = 10
+
 class Blockchain:
 
-    def __init__(self):
-        self.chain = []
-        self.transactions = []
-        self.create_block(proof = 1, previous_hash = '0')
+    def __init__(self, directory = 'ubcoins-node', checkpoint_key = None):
+        # blocks are kept on disk as their JSON encoding and decoded on access
+        self.store = chainstore.ChainStore(directory)
+        self.chain = chainstore.BlockSequence(self.store, json.loads)
+        # the stored blocks below validated_height are known to be valid
+        self.validated_height = 0
+        self.validated_hash = None
+        # trusted block hashes by height, and the RSA key signing checkpoints
+        self.checkpoints = {}
+        self.checkpoint_key = checkpoint_key
+        # pending transactions by hash, ordered for block assembly
+        self.transactions = mempool.Mempool()
+        if len(self.chain) == 0:
+            self.create_block(proof = 1, previous_hash = '0')
         self.nodes = set()
+        # keep-alive connections to the peers, opened on first use
+        self.session = None
+        self.miner = mining.Miner()
     
     def create_block(self, proof, previous_hash):
+        transactions = [transaction.to_dict() for transaction
+                        in self.transactions.select_for_block(MAX_BLOCK_BYTES)]
         block = {'index': len(self.chain) + 1,
                  'timestamp': str(datetime.datetime.now()),
                  'proof': proof,
                  'previous_hash': previous_hash,
-                 'transactions': self.transactions}
-        self.transactions = []
-        self.chain.append(block)
+                 'merkle_root': self.merkle_tree(transactions).root.hex(),
+                 'transactions': transactions}
+        self.append_block(block)
         return block
 
+    def append_block(self, block):
+        self.store.append(json.dumps(block, sort_keys = True).encode(), self.hash(block))
+
     def get_previous_block(self):
         return self.chain[-1]
 
     def proof_of_work(self, previous_proof):
-        new_proof = 1
-        check_proof = False
-        while check_proof is False:
-            hash_operation = hashlib.sha256(str(new_proof**2 - previous_proof**2).encode()).hexdigest()
-            if hash_operation[:4] == '0000':
-                check_proof = True
-            else:
-                new_proof += 1
-        return new_proof
+        # scan new_proof = 1, 2, ... on all cores; None if cancelled
+        result = self.miner.mine(mining.scan_square_difference, previous_proof, start = 1)
+        print(f'proof of work: {result.hashes} hashes at {int(result.hash_rate)} hashes/s')
+        return result.nonce
     
     def hash(self, block):
         encoded_block = json.dumps(block, sort_keys = True).encode()
         return hashlib.sha256(encoded_block).hexdigest()
+
+    # Merkle tree over the hashes of a block's transaction dicts; proofs
+    # from it are checked against block['merkle_root'] with merkle.verify_proof
+    def merkle_tree(self, transactions):
+        return merkle.MerkleTree([hashlib.sha256(json.dumps(transaction, sort_keys = True).encode()).digest()
+                                  for transaction in transactions])
     
-    def is_chain_valid(self, chain):
-        previous_block = chain[0]
-        block_index = 1
-        while block_index < len(chain):
+    # length of the valid prefix of chain, checking blocks start, start + 1, ...
+    # against the blocks before them and against the checkpoints
+    def valid_length(self, chain, start, hash_at):
+        if start == 0:
+            if 0 in self.checkpoints and hash_at(0) != self.checkpoints[0]:
+                return 0
+            start = 1
+        if start >= len(chain):
+            return len(chain)
+        previous_block = chain[start - 1]
+        for block_index in range(start, len(chain)):
             block = chain[block_index]
-            if block['previous_hash'] != self.hash(previous_block):
-                return False
+            if block['previous_hash'] != hash_at(block_index - 1):
+                return block_index
             previous_proof = previous_block['proof']
             proof = block['proof']
             hash_operation = hashlib.sha256(str(proof**2 - previous_proof**2).encode()).hexdigest()
             if hash_operation[:4] != '0000':
-                return False
+                return block_index
+            # blocks from before Merkle roots were added carry none
+            if 'merkle_root' in block and \
+                    block['merkle_root'] != self.merkle_tree(block['transactions']).root.hex():
+                return block_index
+            if block_index in self.checkpoints and hash_at(block_index) != self.checkpoints[block_index]:
+                return block_index
             previous_block = block
-            block_index += 1
+        return len(chain)
+
+    # highest index at which chain holds the same block as the validated part
+    # of the stored chain, found with O(log n) block hashes; -1 if none
+    def find_anchor(self, chain):
+        high = min(len(chain), self.validated_height) - 1
+        # the common case: chain extends the validated chain
+        if high >= 0 and self.hash(chain[high]) == self.store.hash_at(high):
+            return high
+        low = -1
+        high -= 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.hash(chain[middle]) == self.store.hash_at(middle):
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    # the anchor (see find_anchor) of a valid peer chain, or None if the
+    # blocks after it are not valid; costs O(blocks after the anchor)
+    def validate_chain(self, chain):
+        self.is_chain_valid(self.chain)
+        anchor = self.find_anchor(chain)
+        hashes = {}
+        def hash_at(index):
+            if index <= anchor:
+                return self.store.hash_at(index)
+            if index not in hashes:
+                hashes[index] = self.hash(chain[index])
+            return hashes[index]
+        if self.valid_length(chain, anchor + 1, hash_at) != len(chain):
+            return None
+        return anchor
+
+    def is_chain_valid(self, chain):
+        if chain is not self.chain:
+            return self.validate_chain(chain) is not None
+        # the stored chain: only the blocks added since the last validated
+        # height and hash are checked, the hashes coming from the store index
+        if self.validated_height > len(chain) or \
+                (self.validated_height and chain.hash_at(self.validated_height - 1) != self.validated_hash):
+            self.validated_height = 0
+        self.validated_height = self.valid_length(chain, self.validated_height, chain.hash_at)
+        self.validated_hash = chain.hash_at(self.validated_height - 1) if self.validated_height else None
+        return self.validated_height == len(chain)
+
+    # trust the block hash at height (0 for the genesis block), either given
+    # locally or signed by the holder of checkpoint_key (PKCS#1 v1.5 over
+    # "height:hash", hex-encoded); returns whether the checkpoint was added
+    def add_checkpoint(self, height, block_hash, signature = None):
+        if signature is not None:
+            if self.checkpoint_key is None:
+                return False
+            h = SHA256.new(f'{height}:{block_hash}'.encode())
+            try:
+                pkcs1_15.new(self.checkpoint_key).verify(h, binascii.unhexlify(signature))
+            except (ValueError, TypeError, binascii.Error):
+                return False
+        self.checkpoints[height] = block_hash
+        # stored blocks from height on are checked against it again
+        self.validated_height = min(self.validated_height, height)
         return True
     
 
@@ -89,7 +197,11 @@ class Blockchain:
             print("transaction error 2");
             return False;
         
-        self.transactions.append(transaction);
+        if not self.transactions.add(transaction.hash, transaction,
+                                     getattr(sender, 'identity', sender),
+                                     len(json.dumps(transaction.to_dict()))):
+            print("transaction error 3: duplicate");
+            return False;
         previous_block = self.get_previous_block()
         return previous_block['index'] + 1
     
@@ -97,23 +209,70 @@ class Blockchain:
         parsed_url = urlparse(address)
         self.nodes.add(parsed_url.netloc)
     
-    def replace_chain(self):
-        network = self.nodes
-        longest_chain = None
-        max_length = len(self.chain)
-        for node in network:
-            response = requests.get(f'http://{node}/get_chain')
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
-                if length > max_length and self.is_chain_valid(chain):
-                    max_length = length
-                    longest_chain = chain
-        if longest_chain:
-            self.chain = longest_chain
-            return True
+    def peer_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = PEER_TIMEOUT))
+        return self.session
+
+    async def close_session(self):
+        if self.session is not None:
+            await self.session.close()
+
+    # a peer's chain, or None if it is unreachable, too slow or answers badly
+    async def fetch_chain(self, session, node):
+        try:
+            async with session.get(f'http://{node}/get_chain') as response:
+                if response.status != 200:
+                    return None
+                chain = (await response.json())['chain']
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+            return None
+        return chain if self.well_formed(chain) else None
+
+    # whether chain is a list of blocks with the fields validation reads
+    def well_formed(self, chain):
+        return isinstance(chain, list) and all(
+            isinstance(block, dict)
+            and isinstance(block.get('proof'), int)
+            and isinstance(block.get('previous_hash'), str)
+            and isinstance(block.get('transactions'), list)
+            and isinstance(block.get('merkle_root', ''), str)
+            for block in chain)
+
+    # fetch every peer's chain at once and adopt the first valid chain longer
+    # than ours; the fetches still running are then cancelled, so syncing
+    # takes as long as the slowest peer needed rather than all peers in turn
+    async def replace_chain(self):
+        loop = asyncio.get_running_loop()
+        session = self.peer_session()
+        fetches = [asyncio.ensure_future(self.fetch_chain(session, node)) for node in self.nodes]
+        try:
+            for fetch in asyncio.as_completed(fetches):
+                chain = await fetch
+                if chain is not None and len(chain) > len(self.chain):
+                    try:
+                        anchor = await loop.run_in_executor(None, self.validate_chain, chain)
+                    except (KeyError, TypeError, ValueError):
+                        # a peer's bad chain must not end the sync with the others
+                        anchor = None
+                    if anchor is not None:
+                        await loop.run_in_executor(None, self.adopt_chain, chain, anchor)
+                        return True
+        finally:
+            for fetch in fetches:
+                fetch.cancel()
         return False
 
+    # replace the blocks after anchor by those of a chain from validate_chain
+    def adopt_chain(self, chain, anchor):
+        # keep the stored blocks up to the anchor, append the validated rest
+        self.store.replace(anchor + 1, [(json.dumps(block, sort_keys = True).encode(), self.hash(block))
+                                        for block in chain[anchor + 1:]])
+        self.validated_height = len(self.chain)
+        self.validated_hash = self.chain.hash_at(-1)
+        # a block mined on top of the old chain would be stale
+        self.miner.cancel()
+
 class Client:
    def __init__(self):
       random = Crypto.Random.new().read
@@ -147,7 +306,7 @@ class Transaction (object):
      
         return collections.OrderedDict({
            'sender': identity,
-           'receiver': self.receiver,
+           'receiver': getattr(self.receiver, 'identity', self.receiver),
            'amount': self.amt,
            'time' : self.time})
 
@@ -174,8 +333,10 @@ class Transaction (object):
 
 # Part 2 - Mining our Blockchain
 
-# Creating a Web App
-app = Flask(__name__)
+# Creating a Web App; requests are served by an asyncio event loop, while
+# mining, signing and verifying and chain validation run on its default
+# thread pool executor so the node keeps answering during them
+routes = web.RouteTableDef()
 
 # Creating an address for the node on Port 5000
 node_address = str(uuid4()).replace('-', '')
@@ -183,25 +344,34 @@ node_address = str(uuid4()).replace('-', '')
 # Creating a Blockchain
 blockchain = Blockchain()
 
+# one nonce search at a time, and one change to the chain at a time
+mining_lock = asyncio.Lock()
+chain_lock = asyncio.Lock()
+
+def run_in_executor(function, *args):
+    return asyncio.get_running_loop().run_in_executor(None, function, *args)
+
 # Mining a new block
-@app.route('/mine_block', methods = ['GET'])
-def mine_block():
-    previous_block = blockchain.get_previous_block()
-    previous_proof = previous_block['proof']
-    proof = blockchain.proof_of_work(previous_proof)
-    previous_hash = blockchain.hash(previous_block)
-    initialSender = Client()
-    initialSender._id = node_address
-    firstClient = Client()
-    blockchain.add_transaction(sender =
-                               initialSender,
-                               receiver = firstClient,
-                               amount = 1)
-    # validate transaction here: TBD: Add validation code
-    block = blockchain.create_block(proof, previous_hash)
-    transactions = []
-    for transaction in block['transactions']:
-        transactions.append(str(transaction.to_dict()))
+@routes.get('/mine_block')
+async def mine_block(request):
+    # held until the block is appended, so a queued request mines on top of it
+    async with mining_lock:
+        previous_block = blockchain.get_previous_block()
+        previous_hash = blockchain.hash(previous_block)
+        proof = await run_in_executor(blockchain.proof_of_work, previous_block['proof'])
+        if proof is None:
+            return web.json_response({'message': 'Mining was cancelled because the chain changed.'}, status = 409)
+        async with chain_lock:
+            # the chain may have been replaced while mining
+            if blockchain.hash(blockchain.get_previous_block()) != previous_hash:
+                return web.json_response({'message': 'Mining was cancelled because the chain changed.'}, status = 409)
+            initialSender = await run_in_executor(Client)
+            initialSender._id = node_address
+            firstClient = await run_in_executor(Client)
+            await run_in_executor(blockchain.add_transaction, initialSender, firstClient, 1)
+            # validate transaction here: TBD: Add validation code
+            block = blockchain.create_block(proof, previous_hash)
+    transactions = block['transactions']
 
     print (json.dumps(transactions))
 
@@ -211,62 +381,74 @@ def mine_block():
                 'proof': block['proof'],
                 'previous_hash': block['previous_hash'],
                 'transactions': transactions}
-    return jsonify(response), 200
+    return web.json_response(response, status = 200)
 
 # Getting the full Blockchain
-@app.route('/get_chain', methods = ['GET'])
-def get_chain():
-    response = {'chain': str(blockchain.chain),
-                'length': len(blockchain.chain)}
-    return jsonify(response), 200
+@routes.get('/get_chain')
+async def get_chain(request):
+    chain = await run_in_executor(blockchain.chain.snapshot)
+    response = {'chain': chain,
+                'length': len(chain)}
+    return web.json_response(response, status = 200)
 
 # Checking if the Blockchain is valid
-@app.route('/is_valid', methods = ['GET'])
-def is_valid():
-    is_valid = blockchain.is_chain_valid(blockchain.chain)
+@routes.get('/is_valid')
+async def is_valid(request):
+    async with chain_lock:
+        is_valid = await run_in_executor(blockchain.is_chain_valid, blockchain.chain)
     if is_valid:
         response = {'message': 'All good. The Blockchain is valid.'}
     else:
         response = {'message': 'we have a problem. The Blockchain is not valid.'}
-    return jsonify(response), 200
+    return web.json_response(response, status = 200)
 
 # Adding a new transaction to the Blockchain
-@app.route('/add_transaction', methods = ['POST'])
-def add_transaction():
-    json = request.get_json()
+@routes.post('/add_transaction')
+async def add_transaction(request):
+    json = await request.json()
     transaction_keys = ['sender', 'receiver', 'amount']
     if not all(key in json for key in transaction_keys):
-        return 'Some elements of the transaction are missing', 400
-    index = blockchain.add_transaction(json['sender'], json['receiver'], json['amount'])
+        return web.Response(text = 'Some elements of the transaction are missing', status = 400)
+    index = await run_in_executor(blockchain.add_transaction, json['sender'], json['receiver'], json['amount'])
     response = {'message': f'This transaction will be added to Block {index}'}
-    return jsonify(response), 201
+    return web.json_response(response, status = 201)
 
 # Part 3 - Decentralizing our Blockchain
 
 # Connecting new nodes
-@app.route('/connect_node', methods = ['POST'])
-def connect_node():
-    json = request.get_json()
+@routes.post('/connect_node')
+async def connect_node(request):
+    json = await request.json()
     nodes = json.get('nodes')
     if nodes is None:
-        return "No node", 400
+        return web.Response(text = "No node", status = 400)
     for node in nodes:
         blockchain.add_node(node)
     response = {'message': 'All the nodes are now connected. The UBcoin Blockchain now contains the following nodes:',
                 'total_nodes': list(blockchain.nodes)}
-    return jsonify(response), 201
+    return web.json_response(response, status = 201)
 
 # Replacing the chain by the longest chain if needed
-@app.route('/replace_chain', methods = ['GET'])
-def replace_chain():
-    is_chain_replaced = blockchain.replace_chain()
+@routes.get('/replace_chain')
+async def replace_chain(request):
+    async with chain_lock:
+        is_chain_replaced = await blockchain.replace_chain()
+    chain = await run_in_executor(blockchain.chain.snapshot)
     if is_chain_replaced:
         response = {'message': 'The nodes had different chains so the chain was replaced by the longest one.',
-                    'new_chain': blockchain.chain}
+                    'new_chain': chain}
     else:
         response = {'message': 'All good. The chain is the largest one.',
-                    'actual_chain': blockchain.chain}
-    return jsonify(response), 200
+                    'actual_chain': chain}
+    return web.json_response(response, status = 200)
+
+async def close_peer_session(app):
+    await blockchain.close_session()
+
+app = web.Application()
+app.add_routes(routes)
+app.on_cleanup.append(close_peer_session)
 
 # Running the app
-app.run(host = '127.0.0.1', port = 5000)
\ No newline at end of file
+if __name__ == '__main__':
+    web.run_app(app, host = '127.0.0.1', port = 5000)
@@ -0,0 +1,128 @@
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# the node script has a hyphenated name and creates its blockchain in the
+# working directory on import, so it is loaded from a temporary directory
+@pytest.fixture
+def node(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location('old_blockchain', os.path.join(HERE, 'old-blockchain.py'))
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, 'old_blockchain', module)
+    spec.loader.exec_module(module)
+    return module
+
+
+def mined_chain(module, directory, blocks):
+    peer = module.Blockchain(directory = directory)
+    for i in range(blocks):
+        previous_block = peer.get_previous_block()
+        peer.create_block(peer.proof_of_work(previous_block['proof']), peer.hash(previous_block))
+    return list(peer.chain)
+
+
+# a stand-in peer on a free loopback port answering /get_chain with body after
+# delay seconds, or once release is set
+async def stand_in(body, status = 200, delay = 0, release = None):
+    async def get_chain(request):
+        await asyncio.sleep(delay)
+        if release is not None:
+            await release.wait()
+        if isinstance(body, str):
+            return web.Response(text = body, status = status)
+        return web.json_response(body, status = status)
+    app = web.Application()
+    app.router.add_get('/get_chain', get_chain)
+    runner = web.AppRunner(app, shutdown_timeout = 0)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    (host, port) = runner.addresses[0][:2]
+    return (runner, f'{host}:{port}')
+
+# a loopback address nothing listens on
+async def closed_port():
+    (runner, address) = await stand_in({})
+    await runner.cleanup()
+    return address
+
+
+def test_replace_chain_adopts_fast_valid_peer_and_cancels_slow_fetch(node, monkeypatch):
+    blockchain = node.blockchain
+    longer = mined_chain(node, 'ubcoins-peer', 3)
+    broken = [dict(block, proof = 'x') for block in longer] + [{}]
+    monkeypatch.setattr(node, 'PEER_TIMEOUT', 60)
+
+    # record which fetches end by cancellation
+    fetch_chain = blockchain.fetch_chain
+    cancelled = []
+    async def recording_fetch_chain(session, peer):
+        try:
+            return await fetch_chain(session, peer)
+        except asyncio.CancelledError:
+            cancelled.append(peer)
+            raise
+    monkeypatch.setattr(blockchain, 'fetch_chain', recording_fetch_chain)
+
+    async def run():
+        # the slow peer answers only after the sync is over
+        release = asyncio.Event()
+        peers = [await stand_in({'chain': longer, 'length': len(longer)}, delay = 0.2),
+                 await stand_in({'chain': longer, 'length': len(longer)}, release = release),
+                 await stand_in('{not json'),
+                 await stand_in({'chain': [1, 2, 3, 4, 5, 6]}),
+                 await stand_in({'chain': broken, 'length': len(broken)}),
+                 await stand_in('Internal Server Error', status = 500)]
+        (fast, slow) = (peers[0][1], peers[1][1])
+        for (runner, address) in peers:
+            blockchain.add_node(f'http://{address}')
+        blockchain.add_node(f'http://{await closed_port()}')
+        try:
+            start = time.monotonic()
+            replaced = await blockchain.replace_chain()
+            elapsed = time.monotonic() - start
+        finally:
+            release.set()
+            await blockchain.close_session()
+            for (runner, address) in peers:
+                await runner.cleanup()
+        return (replaced, elapsed, fast, slow)
+
+    (replaced, elapsed, fast, slow) = asyncio.run(run())
+    assert replaced
+    assert blockchain.chain.snapshot() == longer
+    assert blockchain.is_chain_valid(blockchain.chain)
+    # the sync ends with the fast peer; the slow peer's fetch is cancelled
+    assert elapsed < 10
+    assert slow in cancelled and fast not in cancelled
+
+
+def test_replace_chain_keeps_chain_without_valid_longer_peer(node):
+    blockchain = node.blockchain
+    before = blockchain.chain.snapshot()
+
+    async def run():
+        peers = [await stand_in('{not json'),
+                 await stand_in({'chain': [{'proof': 1}] * 5}),
+                 await stand_in({'chain': before, 'length': len(before)}),
+                 await stand_in('Internal Server Error', status = 500)]
+        for (runner, address) in peers:
+            blockchain.add_node(f'http://{address}')
+        blockchain.add_node(f'http://{await closed_port()}')
+        try:
+            return await blockchain.replace_chain()
+        finally:
+            await blockchain.close_session()
+            for (runner, address) in peers:
+                await runner.cleanup()
+
+    assert not asyncio.run(run())
+    assert blockchain.chain.snapshot() == before
@@ -13,7 +13,6 @@ Blockchain Testing:
 """
 # import libraries
 import sys
-import hashlib
 import binascii
 import datetime
 import collections
@@ -22,6 +21,34 @@ import Crypto.Random
 from Crypto.Hash import SHA
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
+import mining
+import addresses
+import balances
+import chainstore
+import mempool
+import merkle
+import serialization
+import verification
+
+# nonce search engine used by mine()
+MINER = mining.Miner()
+
+# number of identity, to_dict, payload and hash recomputations avoided by the
+# values memoized on clients and transactions
+MEMO_HITS = collections.Counter()
+
+# directory of the on-disk chain, kept across runs
+CHAIN_DIRECTORY = 'ubcoins-rsa'
+
+# size limit of the transactions taken from the mempool into one block
+MAX_BLOCK_BYTES = 1024 * 1024
+
+# balance of every address on the stored chain, kept up to date as blocks
+# are appended
+BALANCES = balances.BalanceIndex()
+
+# full public keys of the known addresses, looked up when verifying
+KEYS = addresses.KeyRegistry()
 
 # 1. Client class
 class Client:
@@ -30,19 +57,45 @@ class Client:
         self._private_key = RSA.generate(key_length, random)
         self._public_key = self._private_key.publickey()
         self.signer = PKCS1_v1_5.new(self._private_key)
+        KEYS.register(self._public_key.exportKey(format='DER'))
+        self._identity = None
         
+    # short address of the DER key, the only part of it carried by
+    # transactions; computed on first use
     @property
     def identity(self):
-        return binascii.hexlify(self._public_key.exportKey(format='DER')).decode('ascii')
+        if self._identity is None:
+            self._identity = addresses.address_of(self._public_key.exportKey(format='DER'))
+        else:
+            MEMO_HITS['identity'] += 1
+        return self._identity
     
 # 2. Transaction class
 class Transaction:
-    def __init__(self, sender, recipient, value):
+    # fields covered by to_dict() and payload(); setting one drops both
+    # memoized values
+    _PAYLOAD_FIELDS = ('sender', 'recipient', 'value', 'time', 'minted')
+    # fields covered by hash(), the transaction's mempool key, which is
+    # memoized too
+    _HASH_FIELDS = _PAYLOAD_FIELDS + ('signature',)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in Transaction._PAYLOAD_FIELDS:
+            object.__setattr__(self, '_dict', None)
+            object.__setattr__(self, '_payload', None)
+        if name in Transaction._HASH_FIELDS:
+            object.__setattr__(self, '_hash', None)
+
+    # a minted transaction creates the value it sends; its payload carries
+    # the empty genesis sender, though the sender client still signs it
+    def __init__(self, sender, recipient, value, minted=False):
         self.sender = sender
         self.recipient = recipient
         self.value = value
+        self.minted = minted
         self.signature = None
-        self.time = datetime.datetime.now()
+        self.time = serialization.now()
         self.sign_time_start = 0
         self.sign_time_end = 0
         self.sign_time_duration = 0
@@ -51,35 +104,62 @@ class Transaction:
         self.verify_time_duration = 0
         
     def to_dict(self):
-        if self.sender == "Genesis":
+        if self._dict is not None:
+            MEMO_HITS['to_dict'] += 1
+            return self._dict
+        if self.minted or self.sender == "Genesis":
             identity = "Genesis"
         else:
             identity = self.sender.identity
             
-        return collections.OrderedDict({
+        self._dict = collections.OrderedDict({
             'sender':identity,
             'recipient':self.recipient,
             'value':self.value,
             'time':self.time})
+        return self._dict
     
+    # canonical binary encoding of the signed fields
+    def payload(self):
+        if self._payload is not None:
+            MEMO_HITS['payload'] += 1
+            return self._payload
+        if self.minted or self.sender == "Genesis":
+            sender = b''
+        else:
+            sender = serialization.hex_to_bytes(self.sender.identity)
+        self._payload = serialization.encode_payload(sender, serialization.hex_to_bytes(self.recipient),
+                                                     self.value, self.time)
+        return self._payload
+
+    # SHA-256 of the signed transaction, as a hex string; the key of the
+    # transaction in the mempool
+    def hash(self):
+        if self._hash is not None:
+            MEMO_HITS['hash'] += 1
+            return self._hash
+        self._hash = serialization.hash_hex(self.serialize())
+        return self._hash
+
+    # canonical binary encoding of the signed transaction
+    def serialize(self):
+        return serialization.encode_transaction(self.payload(), [serialization.hex_to_bytes(self.signature)])
+
     def sign_transaction(self):
         self.sign_time_start = datetime.datetime.now().timestamp()*1000
         private_key = self.sender._private_key
         signer = PKCS1_v1_5.new(private_key)
-        h = SHA.new(str(self.to_dict()).encode('utf8'))
+        h = SHA.new(self.payload())
         self.signature = binascii.hexlify(signer.sign(h)).decode('ascii')
         self.sign_time_end = datetime.datetime.now().timestamp()*1000
         self.sign_time_duration = self.sign_time_end - self.sign_time_start
 
     def verify_transaction(self, public_key,signature,transaction_info):
         self.verify_time_start = datetime.datetime.now().timestamp()*1000
-        h = SHA.new(str(transaction_info).encode('utf8'))
-        isValid = False
-        try:
-            PKCS1_v1_5.new(public_key).verify(h, signature)
+        isValid = check_signature(public_key, signature, transaction_info)
+        if isValid:
             print ("The signature is valid")
-            isValid = True
-        except (ValueError, TypeError):
+        else:
             print ("The signature is not valid")
         self.verify_time_end = datetime.datetime.now().timestamp()*1000
         self.verify_time_duration = self.verify_time_end - self.verify_time_start
@@ -92,6 +172,69 @@ class Block:
         self.previous_block_hash = ""
         self.Nonce = ""
 
+    # Merkle tree over the raw transaction hashes, in block order
+    def merkle_tree(self):
+        return merkle.MerkleTree([bytes.fromhex(t.hash()) for t in self.verified_transactions])
+
+    # canonical binary encoding of the block header
+    def header(self):
+        return serialization.encode_block_header(serialization.hex_to_bytes(self.previous_block_hash),
+                                                 serialization.hex_to_bytes(self.Nonce),
+                                                 self.merkle_tree().root,
+                                                 len(self.verified_transactions))
+
+    # canonical binary encoding of the block
+    def serialize(self):
+        return serialization.encode_block(serialization.hex_to_bytes(self.previous_block_hash),
+                                          serialization.hex_to_bytes(self.Nonce),
+                                          self.merkle_tree().root,
+                                          [t.serialize() for t in self.verified_transactions])
+
+    # SHA-256 of the canonical header encoding, as a hex string
+    def hash(self):
+        return serialization.hash_hex(self.header())
+
+    # proof that the transaction at index is in the block, checked against
+    # the Merkle root in its header with merkle.verify_proof
+    def inclusion_proof(self, index):
+        return self.merkle_tree().proof(index)
+
+
+# function to check a transaction signature (hex-encoded, as produced by
+# sign_transaction) over its payload
+def check_signature(public_key, signature, transaction_info):
+    h = SHA.new(transaction_info)
+    try:
+        return PKCS1_v1_5.new(public_key).verify(h, binascii.unhexlify(signature))
+    except (ValueError, TypeError, binascii.Error):
+        return False
+
+# keys imported by a worker process, by DER encoding
+_imported_keys = verification.KeyCache(RSA.importKey)
+
+def _verify_worker(job):
+    (public_key_der, signature, transaction_info) = job
+    return check_signature(_imported_keys.get(public_key_der), signature, transaction_info)
+
+# public keys are looked up by sender address and sent to the workers
+# DER-encoded; a sender whose key cannot be resolved fails verification
+def _verify_job(t):
+    public_key = KEYS.get(t.sender.identity)
+    if public_key is None:
+        return None
+    return (public_key, t.signature, t.payload())
+
+# function to verify transactions in parallel over a pool of worker processes;
+# returns the verdicts in transaction order. If needed is given, stops once that
+# many transactions are valid and leaves the unchecked verdicts as None
+def verify_batch(transactions, workers=None, needed=None):
+    return verification.verify_batch(transactions, _verify_job, _verify_worker, workers, needed)
+
+# function to queue a signed transaction in the mempool, under its hash and
+# sender address; returns False for a duplicate
+def submit_transaction(pool, transaction):
+    return pool.add(transaction.hash(), transaction, transaction.sender.identity,
+                    len(transaction.serialize()))
 
 # function to display transactions    
 def display_transaction(transaction):
@@ -100,7 +243,7 @@ def display_transaction(transaction):
     print("sender: " + str(dict['sender'])[-25:])
     print("recipient: " + str(dict['recipient'])[-25:])
     print("value: " + str(dict['value'])[-25:])
-    print("time: " + str(dict['time']))
+    print("time: " + serialization.format_timestamp(dict['time']))
 
 
 # function to dump the transaction onto Blockchain    
@@ -125,24 +268,25 @@ def dump_blockchain(UBCoins, key_length):
     print ("RSA Key Length: ",key_length)
     print ("Average Sign Time: ",(total_sign_time/counter))
     print ("Average Verify Time: ",(total_verify_time/counter))
+    for address in sorted({t.recipient for block in UBCoins for t in block.verified_transactions}):
+        print ("Balance of " + address[-25:] + ": ", BALANCES.balance(address))
+    print ("Memoized Identity/to_dict/Payload/Hash Recomputations Avoided: ",
+           MEMO_HITS['identity'], "/", MEMO_HITS['to_dict'], "/", MEMO_HITS['payload'], "/", MEMO_HITS['hash'])
 
-
-def sha256(message):
-    return hashlib.sha256(message.encode('ascii')).hexdigest()
-
-# function to mine the block
+# function to mine the block with the given hex hash, scanning the nonces on
+# all cores
 def mine(message, difficulty = 1):
     assert difficulty >= 1
     prefix = '1' * difficulty
-    for i in range(10000000):
-        digest = sha256(str(hash(message)) + str(i))
-        if digest.startswith(prefix):
-            print("after " + str(i) + " iterations found nonce: " + digest)
-        return digest
+    result = MINER.mine(mining.scan_prefix, (message, prefix), limit=10000000)
+    if result.nonce is not None:
+        print("after " + str(result.nonce) + " iterations found nonce: " + result.digest)
+    print("mining rate: " + str(int(result.hash_rate)) + " hashes/s over " + str(MINER.workers) + " processes")
+    return result.digest
 
 
 def main():
-    transactions = []
+    transactions = mempool.Mempool()
     UBCoins = []
     key_length = input("Enter RSA Key Length: ")
     key_length = int(key_length)
@@ -156,21 +300,20 @@ def main():
     Professor = Client(key_length)
     
     # transactions
-    t0 = Transaction(Genesis, Peter.identity, 5000)
+    t0 = Transaction(Genesis, Peter.identity, 5000, minted=True)
     t0.sign_transaction()
-    transactions.append(t0)
     t1 = Transaction(Peter, Arzu.identity, 100)
     t1.sign_transaction()
-    transactions.append(t1)
+    submit_transaction(transactions, t1)
     t2 = Transaction(Peter, Sathia.identity, 150)
     t2.sign_transaction()
-    transactions.append(t2)
+    submit_transaction(transactions, t2)
     t3 = Transaction(Arzu, Sathia.identity, 75)
     t3.sign_transaction()
-    transactions.append(t3)
+    submit_transaction(transactions, t3)
     t4 = Transaction(Sathia, Professor.identity, 120)
     t4.sign_transaction()
-    transactions.append(t4)
+    submit_transaction(transactions, t4)
     
     # adding the genesis block
     block0 = Block()
@@ -178,38 +321,63 @@ def main():
     Nonce = None
     
     block0.verified_transactions.append(t0)
-    digest = hash(block0)
+    
+    # the genesis block funds this run's clients and extends the chain
+    # stored by earlier runs, whose balances are replayed once
+    store = chainstore.ChainStore(CHAIN_DIRECTORY)
+    replayed = BALANCES.restore(store)
+    if len(store) > 0:
+        block0.previous_block_hash = store.hash_at(-1)
+    digest = block0.hash()
     last_block_hash = digest
     
     UBCoins.append(block0)
+    store.append(block0.serialize(), digest)
+    BALANCES.apply_block(balances.block_transfers(block0.verified_transactions))
     
     # mining the next block (Block 1)
     block1 = Block()
-    last_transaction_index = 1
     
-    # mining the next 2 transactions in block 1
-    for i in range(2):
-        current_transaction = transactions[last_transaction_index]
-        public_key = current_transaction.sender._public_key
-        transaction_info = str(current_transaction.to_dict())
-        signature = current_transaction.signature
-
-        if (current_transaction.verify_transaction(public_key,signature,transaction_info)):
-            temp_transaction = current_transaction
-            # validate transaction, if valid
-            block1.verified_transactions.append(temp_transaction)
-            last_transaction_index += 1
-            temp_transaction = transactions[last_transaction_index]
-            # validate transaction, if valid
-            block1.verified_transactions.append(temp_transaction)
-            last_transaction_index += 1
+    # mining the next 4 transactions from the mempool in block 1, verified in
+    # parallel
+    pending = transactions.select_for_block(MAX_BLOCK_BYTES, max_count=4)
+    verdicts = verify_batch(pending, needed=4)
+    signed = []
+    for (current_transaction, verdict) in zip(pending, verdicts):
+        if verdict:
+            print ("The signature is valid")
+            signed.append(current_transaction)
+        else:
+            print ("The signature is not valid")
+    # validate transaction, if valid and covered by the sender's balance
+    # (including the earlier transactions of the block)
+    spendable = BALANCES.spendable(balances.block_transfers(signed))
+    for (current_transaction, verdict) in zip(signed, spendable):
+        if verdict:
+            block1.verified_transactions.append(current_transaction)
+        else:
+            print("Balance Error: Sender Cannot Cover Transaction")
 
     block1.previous_block_hash = last_block_hash
-    block1.Nonce = mine(block1, 2)
-    digest = hash(block1)
+    block1.Nonce = mine(block1.hash(), 2)
+    digest = block1.hash()
     
     UBCoins.append(block1)
+    store.append(block1.serialize(), digest)
+    BALANCES.apply_block(balances.block_transfers(block1.verified_transactions))
+    # every transaction's inclusion proof against the root in the header
+    leaves = [bytes.fromhex(t.hash()) for t in block1.verified_transactions]
+    proven = merkle.count_proven(block1.merkle_tree(), leaves,
+                                 serialization.decode_block_header(block1.header())[2])
+    print("Merkle Inclusion Proofs Verified: " + str(proven) + "/" + str(len(leaves)))
     last_block_hash = digest
+    print("Blocks stored in " + CHAIN_DIRECTORY + ": " + str(len(store)))
+    print("Blocks replayed into balances on start: " + str(replayed))
+    (stored_transactions, links_valid) = chainstore.scan_headers(store)
+    print ("Stored Blocks/Transactions: ", len(store), "/", stored_transactions)
+    print ("Stored Chain Links Valid: ", links_valid)
+    BALANCES.save(store)
+    store.close()
     
     # dump the blocks into the chain
     dump_blockchain(UBCoins,key_length)
@@ -0,0 +1,166 @@
+"""
+
+Blockchain Serialization:
+
+    Canonical binary encoding of transactions and blocks shared by the
+    blockchain scripts
+
+    Every field is written in a fixed order: integers big-endian with a fixed
+    width, byte strings (raw addresses, signatures, hashes) behind a 4-byte
+    length.
+    The same transaction or block therefore always encodes to the same bytes,
+    in any process, and hashes, signatures and network transfer all operate
+    on that encoding.
+
+"""
+# import libraries
+import time
+import struct
+import hashlib
+import datetime
+
+# version byte leading every encoding; blocks carry a Merkle root from
+# BLOCK_VERSION 2 on and version 1 blocks are still decoded
+VERSION = 1
+BLOCK_VERSION = 2
+
+_LENGTH = struct.Struct('>I')
+_TRANSACTION = struct.Struct('>Qq')
+_BLOCK = struct.Struct('>BI')
+
+# upper bound on the encoded size of a block header, whose previous block
+# hash, nonce and Merkle root are at most SHA-256 digests
+MAX_BLOCK_HEADER_SIZE = _BLOCK.size + 3 * (_LENGTH.size + 32)
+
+
+class DecodeError(ValueError):
+    pass
+
+
+# integer timestamps: microseconds since the Unix epoch
+def now():
+    return time.time_ns() // 1000
+
+def format_timestamp(timestamp):
+    return str(datetime.datetime.fromtimestamp(timestamp / 1000000))
+
+# hex strings (digests, identities) travel as their raw bytes; None and ""
+# encode as the empty byte string
+def hex_to_bytes(value):
+    if not value:
+        return b''
+    return bytes.fromhex(value)
+
+def bytes_to_hex(value):
+    if not value:
+        return None
+    return value.hex()
+
+
+def _pack_bytes(out, value):
+    out += _LENGTH.pack(len(value))
+    out += value
+
+def _unpack_bytes(data, offset):
+    if offset + _LENGTH.size > len(data):
+        raise DecodeError("truncated length at offset " + str(offset))
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    if offset + length > len(data):
+        raise DecodeError("truncated field at offset " + str(offset))
+    return (bytes(data[offset:offset + length]), offset + length)
+
+def _check_version(data, versions=(VERSION,)):
+    if len(data) < 1 or data[0] not in versions:
+        raise DecodeError("unsupported encoding version")
+
+
+# the signed content of a transaction: the sender's raw address (empty for
+# the genesis sender), the recipient's raw address, the value and the timestamp
+def encode_payload(sender, recipient, value, timestamp):
+    out = bytearray([VERSION])
+    _pack_bytes(out, sender)
+    _pack_bytes(out, recipient)
+    out += _TRANSACTION.pack(value, timestamp)
+    return bytes(out)
+
+def decode_payload(data):
+    _check_version(data)
+    (sender, offset) = _unpack_bytes(data, 1)
+    (recipient, offset) = _unpack_bytes(data, offset)
+    if offset + _TRANSACTION.size != len(data):
+        raise DecodeError("bad payload length")
+    (value, timestamp) = _TRANSACTION.unpack_from(data, offset)
+    return (sender, recipient, value, timestamp)
+
+# a transaction as stored and sent: its payload followed by the signature
+# fields of the signature scheme (e.g. the RSA signature, or the FrodoKEM
+# cypher text and hashed message)
+def encode_transaction(payload, signature_fields):
+    out = bytearray()
+    _pack_bytes(out, payload)
+    out.append(len(signature_fields))
+    for field in signature_fields:
+        _pack_bytes(out, field)
+    return bytes(out)
+
+def decode_transaction(data):
+    (payload, offset) = _unpack_bytes(data, 0)
+    if offset >= len(data):
+        raise DecodeError("missing signature fields")
+    count = data[offset]
+    offset += 1
+    signature_fields = []
+    for i in range(count):
+        (field, offset) = _unpack_bytes(data, offset)
+        signature_fields.append(field)
+    if offset != len(data):
+        raise DecodeError("trailing bytes after transaction")
+    return (payload, signature_fields)
+
+# a block header: the raw previous block hash (empty for the genesis block),
+# the raw nonce digest, the raw Merkle root of the transaction hashes and the
+# transaction count. The block hash is taken over the header alone, which
+# commits to the transactions through the Merkle root
+def encode_block_header(previous_hash, nonce, merkle_root, count):
+    out = bytearray(_BLOCK.pack(BLOCK_VERSION, count))
+    _pack_bytes(out, previous_hash)
+    _pack_bytes(out, nonce)
+    _pack_bytes(out, merkle_root)
+    return bytes(out)
+
+# a block: its header followed by the encoded transactions in order
+def encode_block(previous_hash, nonce, merkle_root, transactions):
+    out = bytearray(encode_block_header(previous_hash, nonce, merkle_root, len(transactions)))
+    for transaction in transactions:
+        _pack_bytes(out, transaction)
+    return bytes(out)
+
+# the previous block hash, nonce, Merkle root (None for version 1 blocks) and
+# transaction count of an encoded block, without reading its transactions;
+# also returns the offset they start at
+def decode_block_header(data):
+    _check_version(data, (1, BLOCK_VERSION))
+    if len(data) < _BLOCK.size:
+        raise DecodeError("truncated block header")
+    (version, count) = _BLOCK.unpack_from(data, 0)
+    (previous_hash, offset) = _unpack_bytes(data, _BLOCK.size)
+    (nonce, offset) = _unpack_bytes(data, offset)
+    merkle_root = None
+    if version >= 2:
+        (merkle_root, offset) = _unpack_bytes(data, offset)
+    return (previous_hash, nonce, merkle_root, count, offset)
+
+def decode_block(data):
+    (previous_hash, nonce, merkle_root, count, offset) = decode_block_header(data)
+    transactions = []
+    for i in range(count):
+        (transaction, offset) = _unpack_bytes(data, offset)
+        transactions.append(transaction)
+    if offset != len(data):
+        raise DecodeError("trailing bytes after block")
+    return (previous_hash, nonce, merkle_root, transactions)
+
+# SHA-256 over an encoding, as a hex string
+def hash_hex(data):
+    return hashlib.sha256(data).hexdigest()
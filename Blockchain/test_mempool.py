@@ -0,0 +1,66 @@
+import mempool
+
+
+def test_replacing_only_pending_transaction_keeps_next_nonce():
+    pool = mempool.Mempool()
+    assert pool.add('a', 'a', 'alice', 10, nonce=0)
+    assert pool.add('b', 'b', 'alice', 10, priority=5, nonce=0)
+    assert 'a' not in pool
+    # the next default nonce is 1, not the replaced 0
+    assert pool.add('c', 'c', 'alice', 10)
+    assert pool.select_for_block(1000) == ['b', 'c']
+
+
+def test_duplicate_and_lower_priority_replacement_are_rejected():
+    pool = mempool.Mempool()
+    assert pool.add('a', 'a', 'alice', 10, priority=5, nonce=0)
+    assert not pool.add('a', 'a', 'alice', 10, priority=9, nonce=0)
+    assert not pool.add('b', 'b', 'alice', 10, priority=5, nonce=0)
+    assert pool.get('a') == 'a'
+
+
+def test_selection_by_priority_and_nonce_order():
+    pool = mempool.Mempool()
+    pool.add('a0', 'a0', 'alice', 10, priority=1)
+    pool.add('a1', 'a1', 'alice', 10, priority=9)
+    pool.add('b0', 'b0', 'bob', 10, priority=5)
+    # alice's priority 9 transaction waits for her nonce 0
+    assert pool.select_for_block(1000) == ['b0', 'a0', 'a1']
+    assert len(pool) == 0
+
+
+def test_selection_respects_byte_and_count_limits():
+    pool = mempool.Mempool()
+    pool.add('big', 'big', 'alice', 100, priority=9)
+    pool.add('small', 'small', 'bob', 10, priority=1)
+    pool.add('later', 'later', 'carol', 10, priority=0)
+    assert pool.select_for_block(50, max_count=1) == ['small']
+    assert pool.select_for_block(1000) == ['big', 'later']
+
+
+def test_lowest_priority_evicted_over_cap():
+    pool = mempool.Mempool(max_count=3)
+    for (tx_hash, priority) in [('f', 3), ('g', 1), ('h', 2), ('i', 4)]:
+        pool.add(tx_hash, tx_hash, tx_hash, 10, priority=priority)
+    assert 'g' not in pool
+    assert len(pool) == 3
+
+
+def test_eviction_drops_dependent_nonces():
+    pool = mempool.Mempool(max_bytes=30)
+    pool.add('a0', 'a0', 'alice', 10, priority=1)
+    pool.add('a1', 'a1', 'alice', 10, priority=8)
+    pool.add('b0', 'b0', 'bob', 10, priority=5)
+    assert not pool.add('c0', 'c0', 'carol', 10, priority=0)
+    assert pool.add('d0', 'd0', 'dave', 10, priority=6)
+    # a0 was the lowest priority, and a1 cannot be mined without it
+    assert 'a0' not in pool and 'a1' not in pool
+    assert pool.bytes == 20
+
+
+def test_remove():
+    pool = mempool.Mempool()
+    pool.add('a', 'a', 'alice', 10)
+    assert pool.remove('a')
+    assert not pool.remove('a')
+    assert pool.bytes == 0
@@ -0,0 +1,93 @@
+"""
+
+Blockchain Verification:
+
+    Parallel transaction verification shared by the blockchain scripts
+
+    Each script supplies a worker function, which checks one job in a worker
+    process, and a job builder, which turns a transaction into the plain bytes
+    and strings sent to the worker. The worker processes are started on first
+    use and kept, so later batches neither start new processes nor wait for
+    the verifications an early exit leaves running, and the keys a worker
+    prepares stay cached in it between batches.
+
+"""
+# import libraries
+import datetime
+import threading
+import collections
+import concurrent.futures
+
+# worker process pools by worker count
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool(workers=None):
+    with _pools_lock:
+        executor = _pools.get(workers)
+        if executor is None:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            _pools[workers] = executor
+        return executor
+
+
+# least-recently-used cache of the keys a worker process derived from raw
+# key bytes with make(raw), e.g. FrodoKEM prepared keys or imported RSA keys
+class KeyCache:
+    def __init__(self, make, max_keys=256):
+        self.make = make
+        self.max_keys = max_keys
+        self._keys = collections.OrderedDict()
+
+    def get(self, raw):
+        key = self._keys.get(raw)
+        if key is None:
+            key = self.make(raw)
+            self._keys[raw] = key
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(raw)
+        return key
+
+
+def _now():
+    return datetime.datetime.now().timestamp()*1000
+
+# runs in the worker process: the verdict of worker(job), with the start and
+# end times of the check in milliseconds
+def _timed(worker, job):
+    verify_time_start = _now()
+    return (worker(job), verify_time_start, _now())
+
+# verify transactions in parallel; build_job(transaction) gives the job for
+# worker, or None for a transaction that fails without one (e.g. an unknown
+# sender key), and worker(job) returns whether the job is valid. The verify
+# times are recorded on each checked transaction. Returns the verdicts in
+# transaction order; if needed is given, stops once that many transactions
+# are valid and leaves the unchecked verdicts as None
+def verify_batch(transactions, build_job, worker, workers=None, needed=None):
+    verdicts = [None] * len(transactions)
+    jobs = []
+    for (i, transaction) in enumerate(transactions):
+        job = build_job(transaction)
+        if job is None:
+            verdicts[i] = False
+        else:
+            jobs.append((i, job))
+    valid = 0
+    futures = [(i, pool(workers).submit(_timed, worker, job)) for (i, job) in jobs]
+    try:
+        for (i, future) in futures:
+            transaction = transactions[i]
+            (verdicts[i], transaction.verify_time_start, transaction.verify_time_end) = future.result()
+            transaction.verify_time_duration = transaction.verify_time_end - transaction.verify_time_start
+            valid += verdicts[i]
+            if needed is not None and valid >= needed:
+                break
+    finally:
+        # drop the queued jobs; running ones finish in the background
+        for (i, future) in futures:
+            future.cancel()
+    return verdicts